@@ -0,0 +1,63 @@
+"""
+A `MatlabKernel` running against the fake `matlab.engine`, shared by the tests
+and the benchmarks.
+
+This directory must be on ``sys.path``, and also on ``PYTHONPATH`` so that
+the import order probe (which runs in a subprocess) finds the fake engine;
+`get_env` returns a suitable environment for subprocesses.  Importing this
+module does not modify ``os.environ``.
+"""
+
+import asyncio
+import inspect
+import os
+from pathlib import Path
+
+
+FAKE_ENGINE_DIR = str(Path(__file__).resolve().parent)
+
+
+def get_env(cache_dir, env=None):
+    """
+    Return a copy of *env* (by default, `os.environ`) in which the fake engine
+    is importable and imatlab's cache directory is *cache_dir*.
+    """
+    env = dict(os.environ if env is None else env)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [FAKE_ENGINE_DIR, *filter(None, [env.get("PYTHONPATH")])])
+    env["IMATLAB_CACHE_DIR"] = str(cache_dir)
+    return env
+
+
+def run(value):
+    """Return the reply of a request handler (awaited, with ipykernel>=6)."""
+    if inspect.isawaitable(value):
+        return asyncio.get_event_loop().run_until_complete(value)
+    return value
+
+
+def make_kernel(connection_file="imatlab-fake.json"):
+    """
+    Return a kernel which records the messages it sends (as ``(msg_type,
+    content)`` pairs, in its ``sent`` attribute) instead of sending them.
+
+    The connection file name sets whether the kernel behaves as for a console
+    front-end, and names its workspace checkpoints.
+    """
+    from traitlets.config import Config
+    from imatlab._kernel import MatlabKernel
+
+    class FakeKernel(MatlabKernel):
+        def __init__(self, *args, **kwargs):
+            self.sent = []
+            super().__init__(*args, **kwargs)
+
+        def send_response(self, stream, msg_or_type, content=None, *args,
+                          **kwargs):
+            self.sent.append((msg_or_type, content))
+
+    config = Config()
+    config.IPKernelApp.connection_file = connection_file
+    kernel = FakeKernel(config=config)
+    kernel._history._flush_delay = 0
+    return kernel
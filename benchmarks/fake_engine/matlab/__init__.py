@@ -0,0 +1,13 @@
+"""
+A stand-in for the `matlab` package; see `matlab.engine`.
+"""
+
+import array
+
+
+class double:
+    """A row vector of doubles (stored, as in old engines, in ``_data``)."""
+
+    def __init__(self, values=()):
+        self._data = array.array("d", values)
+        self.size = (1, len(self._data))
@@ -0,0 +1,259 @@
+"""
+A stand-in for `matlab.engine`, to benchmark imatlab without MATLAB.
+
+Only the calls made by imatlab are supported.  Each call sleeps for
+``config["latency"]`` seconds; the cell driver writes ``config["output"]``
+bytes to the C-level stdout and exports ``config["figures"]`` figures of
+``config["figure_size"]`` bytes each.  Defaults can be set with the
+``FAKE_MATLAB_LATENCY``, ``FAKE_MATLAB_OUTPUT``, ``FAKE_MATLAB_FIGURES`` and
+``FAKE_MATLAB_FIGURE_SIZE`` environment variables.
+"""
+
+import json
+import os
+from pathlib import Path
+import re
+import tempfile
+import threading
+import time
+
+import matlab
+
+
+config = {
+    "latency": float(os.environ.get("FAKE_MATLAB_LATENCY", 0)),
+    "output": int(os.environ.get("FAKE_MATLAB_OUTPUT", 0)),
+    "figures": int(os.environ.get("FAKE_MATLAB_FIGURES", 0)),
+    "figure_size": int(os.environ.get("FAKE_MATLAB_FIGURE_SIZE", 2 ** 16)),
+}
+
+
+# Engines shared with `matlab.engine.shareEngine`, by name.
+_shared = {}
+
+
+class EngineError(Exception):
+    pass
+
+
+class MatlabExecutionError(Exception):
+    pass
+
+
+class CancelledError(Exception):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class FutureResult:
+    def __init__(self, func):
+        self._done = threading.Event()
+        self._cancelled = False
+        self._value = self._exc = None
+
+        def target():
+            try:
+                self._value = func()
+            except Exception as exc:
+                self._exc = exc
+            self._done.set()
+
+        threading.Thread(target=target, daemon=True).start()
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        self._cancelled = True
+        return True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError
+        if self._cancelled:
+            raise CancelledError
+        if self._exc is not None:
+            raise self._exc
+        return self._value
+
+
+class MatlabEngine:
+    def __init__(self):
+        self._prefdir = tempfile.mkdtemp(prefix="fake-matlab-")
+        self._cwd = os.getcwd()
+        self._path = []
+        self._alive = True
+        self._generation = 0
+        # Only used by `imatlab_workspace`; tests may populate it directly.
+        self.workspace = {}
+
+    def _call(self, func, *args, background=False, nargout=1,
+              stdout=None, stderr=None):
+        def run():
+            if not self._alive:
+                raise EngineError("MATLAB has terminated")
+            time.sleep(config["latency"])
+            return func(*args)
+        return FutureResult(run) if background else run()
+
+    def builtin(self, name, *args, **kwargs):
+        return self._call(getattr(self, "_builtin_" + name), *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(
+            getattr(self, "_function_" + name), *args, **kwargs)
+
+    def _builtin_eval(self, code):
+        if code.startswith("methods("):
+            return ["mtFindAllTabCompletions"]
+        if "mtFindAllTabCompletions" in code:
+            return ["matlabroot"]
+        if "checkcode" in code:
+            return []
+        if "mtree" in code:
+            return False
+        return 1
+
+    def _builtin_prefdir(self):
+        return self._prefdir
+
+    def _builtin_version(self):
+        return "9.9.0.0 (R2020b)"
+
+    def _builtin_path(self):
+        return os.pathsep.join(self._path)
+
+    def _builtin_cd(self, *args):
+        cwd = self._cwd
+        if args:
+            self._cwd = args[0]
+        return cwd
+
+    def _builtin_which(self, name):
+        return "/fake/{}.m".format(name)
+
+    def _builtin_feature(self, name):
+        return 0  # There is no separate MATLAB process to report on.
+
+    def _builtin_getenv(self, name):
+        return os.environ.get(name, "")
+
+    def _builtin_exit(self):
+        self._alive = False
+
+    def _function_eval(self, code):
+        match = re.fullmatch(r"matlab\.engine\.shareEngine\('(\w+)'\)", code)
+        if not match:
+            raise MatlabExecutionError("Unsupported code: {}".format(code))
+        _shared[match.group(1)] = self
+
+    def _function_exit(self):
+        self._alive = False
+
+    def _function_imatlab_workspace(self, action, file=None):
+        if action == "save":
+            Path(file).write_text(json.dumps(self.workspace))
+            self.workspace = {}
+        elif action == "load":
+            self.workspace = json.loads(Path(file).read_text())
+            os.remove(file)
+        elif action == "clear":
+            self.workspace = {}
+
+    def _function_imatlab_checkpoint(self, action, directory):
+        path = Path(directory, "manifest.mat")
+        if action == "save":
+            previous = (json.loads(path.read_text()) if path.exists()
+                        else {})
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(self.workspace))
+            return {"saved": [name for name, value in self.workspace.items()
+                              if previous.get(name) != value],
+                    "deleted": sorted(previous.keys() - self.workspace.keys()),
+                    "skipped": [], "unhashed": []}
+        elif action == "restore":
+            saved = json.loads(path.read_text())
+            restored = [name for name in saved if name not in self.workspace]
+            self.workspace.update(
+                (name, saved[name]) for name in restored)
+            return {"restored": restored, "failed": []}
+
+    def _function_addpath(self, *args):
+        self._path.extend(arg for arg in args if not arg.startswith("-"))
+
+    def _function_imatlab_export_fig(self, exporter):
+        pass
+
+    def _function_help(self, name):
+        return " {} is a fake function.\n".format(name)
+
+    def _function_imatlab_execute_cell(self, code, export_dir, script):
+        if config["output"]:
+            os.write(1, b"x" * config["output"])
+        exported = []
+        if export_dir:
+            for i in range(config["figures"]):
+                name = "fig{}.png".format(i)
+                Path(export_dir, name).write_bytes(
+                    b"\x89PNG" + b"\0" * config["figure_size"])
+                exported.append(name)
+        return {
+            "status": "ok",
+            "exported": exported,
+            "variables": ["x", "y", "s"],
+            "fields": {"s": ["a", "b"]},
+            "path_state": "0",
+            "timings": {"dbclear": 0., "eval": 0., "detect": 0.,
+                        "export": 0., "workspace": 0.},
+            "dump_timings": bool(os.environ.get("IMATLAB_TIMINGS")),
+        }
+
+    def _function_imatlab_variables(self, action, *args):
+        if action == "list":
+            self._generation += 1
+            return {
+                "names": ["s", "x", "y"],
+                "classes": ["struct", "double", "double"],
+                "sizes": [[[1., 1.]], [[1., 3.]], [[1., 1.]]],
+                "bytes": [192., 24., 8.],
+                "complex": [False, False, False],
+                "signatures": ["struct-[1 1]-192", str(self._generation),
+                               "1"],
+            }
+        elif action == "fetch":
+            name, row0, row1, col0, col1 = args
+            if name == "x":
+                values = [1., 2., 3.][int(col0) - 1:int(col1)]
+                return {"class": "double", "size": [[1., len(values)]],
+                        "real": matlab.double(values),
+                        "imag": matlab.double()}
+            elif name == "y":
+                return {"class": "double", "size": [[1., 1.]],
+                        "real": 1., "imag": matlab.double()}
+            elif name == "s":
+                return {"class": "struct", "size": [[1., 1.]],
+                        "text": "    a: 1\n    b: 2\n"}
+            raise MatlabExecutionError(
+                "Undefined function or variable '{}'.".format(name))
+
+
+def start_matlab(*, background=False):
+    def start():
+        time.sleep(config["latency"])
+        return MatlabEngine()
+    return FutureResult(start) if background else start()
+
+
+def connect_matlab(name=None, *, background=False):
+    if name in _shared:
+        engine = _shared[name]
+        return FutureResult(lambda: engine) if background else engine
+    return start_matlab(background=background)
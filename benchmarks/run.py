@@ -0,0 +1,209 @@
+"""
+Benchmarks of imatlab's own overhead, using a fake `matlab.engine`.
+
+Usage::
+
+    python benchmarks/run.py [-o results.json] [--repeat N]
+
+Results (timings in seconds) are written as JSON, so that they can be compared
+between releases.  MATLAB is not required (see fake_engine/matlab/engine).
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+
+sys.path.insert(0, str(Path(__file__).resolve().with_name("fake_engine")))
+from fake_kernel import get_env, make_kernel, run  # noqa: E402
+
+# Also for the import order probe, which runs in a subprocess.
+os.environ.update(get_env(
+    os.environ.get("IMATLAB_CACHE_DIR") or tempfile.mkdtemp()))
+
+import matlab.engine  # noqa: E402  The fake one.
+
+import imatlab  # noqa: E402
+from imatlab import _kernel, _redirection  # noqa: E402
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": samples[len(samples) // 2],
+        "p99": samples[min(int(len(samples) * .99), len(samples) - 1)],
+    }
+
+
+def _time(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return _stats(samples)
+
+
+def bench_execute(kernel, repeat):
+    results = {}
+    for latency in [0, .001]:
+        matlab.engine.config["latency"] = latency
+        kernel.sent.clear()
+        stats = _time(
+            lambda: run(kernel.do_execute("x = 1;", False)), repeat)
+        stats["messages_per_cell"] = len(kernel.sent) / repeat
+        results["latency={}".format(latency)] = stats
+    matlab.engine.config["latency"] = 0
+    for output in [2 ** 10, 2 ** 20]:
+        matlab.engine.config["output"] = output
+        kernel.sent.clear()
+        stats = _time(
+            lambda: run(kernel.do_execute("disp(x)", False)), repeat)
+        stats["messages_per_cell"] = len(kernel.sent) / repeat
+        results["output={}".format(output)] = stats
+    matlab.engine.config["output"] = 0
+    return results
+
+
+def bench_history(repeat):
+    results = {}
+    for size in [10 ** 2, 10 ** 4, 10 ** 5]:
+        prefdir = Path(tempfile.mkdtemp())
+        (prefdir / "History.xml").write_text(
+            '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>'
+            "<history>\n<session>\n"
+            + "".join("<command>x = {};</command>\n".format(i)
+                      for i in range(size))
+            + "</session>\n</history>")
+        start = time.perf_counter()
+        history = _kernel.MatlabHistory(prefdir)
+        init = time.perf_counter() - start
+        history._flush_delay = 0
+
+        def append():
+            history.append("y = 1;", .1, True)
+            history.flush()
+
+        results["size={}".format(size)] = {
+            "init": init,
+            "append": _time(append, repeat),
+            "tail": _time(lambda: history.get_tail(10), repeat),
+        }
+    return results
+
+
+def bench_export(kernel, repeat):
+    results = {}
+    for figure_size in [2 ** 14, 2 ** 20]:
+        export_dir = Path(kernel._export_dir.name)
+
+        def export():
+            names = []
+            for i in range(10):
+                name = "fig{}.png".format(i)
+                (export_dir / name).write_bytes(b"\0" * figure_size)
+                names.append(name)
+            kernel._export_figures(names)
+
+        stats = _time(export, repeat)
+        stats["bytes_per_second"] = 10 * figure_size / stats["mean"]
+        results["figure_size={}".format(figure_size)] = stats
+    return results
+
+
+def bench_complete(kernel, repeat):
+    run(kernel.do_execute("x = 1;", False))  # Populate the index.
+    time.sleep(.1)  # Let the path be scanned.
+    return {
+        "local": _time(lambda: kernel.do_complete("y = x", 5), repeat),
+        "engine": _time(lambda: kernel.do_complete("ls x", 4), repeat),
+        "is_complete": _time(
+            lambda: kernel.do_is_complete("for i = 1:3\nx(i) = 1;\nend"),
+            repeat),
+        "is_complete_uncached": _time(
+            lambda: kernel._is_complete_cache.clear()
+            or kernel.do_is_complete("for i = 1:3\nx(i) = 1;\nend"),
+            repeat),
+    }
+
+
+def bench_redirection(repeat):
+    results = {}
+    fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        for chunk_size in [2 ** 6, 2 ** 12]:
+            calls = []
+            total = 2 ** 22
+
+            def write():
+                with _redirection.redirect(fd, calls.append, "utf-8"):
+                    data = b"x" * chunk_size
+                    for _ in range(total // chunk_size):
+                        os.write(fd, data)
+
+            stats = _time(write, repeat)
+            stats["bytes_per_second"] = total / stats["mean"]
+            stats["callbacks_per_run"] = len(calls) / repeat
+            results["chunk_size={}".format(chunk_size)] = stats
+    finally:
+        os.close(fd)
+    return results
+
+
+def bench_import(repeat):
+    # Cumulative import time of the kernel module, in a fresh interpreter (the
+    # import order probe is cached by the first run).
+    samples = []
+    for _ in range(repeat + 1):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import imatlab._kernel"],
+            stderr=subprocess.PIPE, universal_newlines=True,
+            check=True).stderr
+        samples.append(int(re.search(
+            r"(?m)^import time:\s*\d+ \|\s*(\d+) \| imatlab\._kernel$",
+            stderr).group(1)) / 1e6)
+    return _stats(samples[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    # The kernel captures the process' stdout, so save it first.
+    out = (open(args.output, "w") if args.output
+           else os.fdopen(os.dup(sys.stdout.fileno()), "w"))
+    results = {
+        "meta": {
+            "imatlab": getattr(imatlab, "__version__", None),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "history": bench_history(args.repeat),
+        "redirection": bench_redirection(max(args.repeat // 10, 1)),
+        "import": bench_import(max(args.repeat // 10, 1)),
+    }
+    kernel = make_kernel("imatlab-bench.json")
+    results["execute"] = bench_execute(kernel, args.repeat)
+    results["export"] = bench_export(kernel, max(args.repeat // 10, 1))
+    results["complete"] = bench_complete(kernel, args.repeat)
+    with out:
+        json.dump(results, out, indent=2)
+        out.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,18 @@
+import sys
+
+
 if __name__ == "__main__":
-    from ipykernel.kernelapp import IPKernelApp
-    from ._kernel import MatlabKernel
+    if sys.argv[1:2] == ["probe"]:
+        from ._probe import main
+        main()
+    elif sys.argv[1:2] == ["broker"]:
+        from ._broker import main
+        main(sys.argv[2:])
+    elif sys.argv[1:2] == ["run"]:
+        from ._runner import main
+        main(sys.argv[2:])
+    else:
+        from ipykernel.kernelapp import IPKernelApp
+        from ._kernel import MatlabKernel
 
-    IPKernelApp.launch_instance(kernel_class=MatlabKernel)
+        IPKernelApp.launch_instance(kernel_class=MatlabKernel)
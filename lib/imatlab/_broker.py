@@ -0,0 +1,366 @@
+"""
+A broker leasing a bounded set of shared MATLAB engines to kernels.
+
+Run it with ``python -mimatlab broker``.  Kernels started with the
+``IMATLAB_BROKER`` environment variable set to the broker's address connect to
+the broker instead of starting their own engine, and lease an engine for the
+duration of each request.  Leases are sticky: a kernel keeps using the same
+engine (and workspace) as long as no other kernel needs it.  When a lease moves
+to another kernel, or after the kernel has been idle for a while, the
+workspace is saved to a file (and restored when the kernel next needs an
+engine).
+
+`matlab.engine` is only imported by the broker process itself.
+"""
+
+import argparse
+import binascii
+from contextlib import contextmanager
+import itertools
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from ._paths import get_cache_dir
+from ._watchdog import release_engine
+
+
+class BrokerError(Exception):
+    pass
+
+
+def get_default_address():
+    if os.name == "nt":
+        return r"\\.\pipe\imatlab-broker-{}".format(
+            os.environ.get("USERNAME", ""))
+    return str(get_cache_dir() / "broker.sock")
+
+
+def _get_authkey(create=False):
+    # Only readable by the current user, like the cache directory itself.
+    path = get_cache_dir() / "broker.key"
+    if create:
+        authkey = binascii.hexlify(os.urandom(32))
+        fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "wb") as file:
+            file.write(authkey)
+        return authkey
+    return path.read_bytes()
+
+
+class _Slot:
+    """A shared engine, and the client whose workspace it currently holds."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.owner = None
+        self.busy = False
+        self.dirty = False  # Holds the workspace of a disconnected client.
+        self.last_used = time.monotonic()
+
+
+class Broker:
+    """
+    Lease *size* shared MATLAB engines to clients.
+
+    Workspaces are saved when a lease moves to another client, or after
+    *idle_timeout* seconds without requests.
+    """
+
+    def __init__(self, size, *, idle_timeout=600):
+        import matlab.engine
+
+        self._idle_timeout = idle_timeout
+        self._state_dir = Path(tempfile.mkdtemp(prefix="imatlab-broker-"))
+        self._client_ids = itertools.count()
+        self._engine_ids = itertools.count()
+        self._cond = threading.Condition()
+        self._saved = {}  # Client id -> saved workspace.
+        self._saving = set()  # Clients whose workspace is being saved.
+        self._lost = set()  # Clients whose workspace could not be saved.
+        self._closed = False
+        self._address = None
+        futures = [matlab.engine.start_matlab(background=True)
+                   for _ in range(size)]
+        self._slots = [self._share(future.result()) for future in futures]
+        threading.Thread(target=self._reap, daemon=True).start()
+
+    def _share(self, engine):
+        name = "imatlab_broker_{}_{}".format(os.getpid(),
+                                             next(self._engine_ids))
+        engine.eval("matlab.engine.shareEngine('{}')".format(name), nargout=0)
+        engine.addpath(str(Path(__file__).with_name("data")), "-end",
+                       nargout=0)
+        return _Slot(name, engine)
+
+    def _find(self, client):
+        for slot in self._slots:
+            if slot.owner == client:
+                return slot
+        return None
+
+    def acquire(self, client):
+        """
+        Lease an engine to *client*; return its name and whether the client's
+        workspace was lost since its last lease.
+        """
+        with self._cond:
+            while True:
+                slot = self._find(client)
+                if slot is None and client not in self._saving:
+                    free = [slot for slot in self._slots
+                            if slot.owner is None and not slot.busy]
+                    idle = [slot for slot in self._slots if not slot.busy]
+                    if free:
+                        slot = free[0]
+                    elif idle:  # Take the least recently used lease.
+                        slot = min(idle, key=lambda slot: slot.last_used)
+                if slot is not None and not slot.busy:
+                    break
+                self._cond.wait()
+            previous = slot.owner
+            slot.owner = client
+            slot.busy = True
+            if previous is not None and previous != client:
+                self._saving.add(previous)
+            saved = self._saved.pop(client, None)
+            lost = client in self._lost
+            self._lost.discard(client)
+        if previous != client:
+            if previous is not None:
+                self._save(slot, previous)
+            elif slot.dirty:
+                self._call(slot, "clear")
+            slot.dirty = False
+            if saved is not None:
+                self._call(slot, "load", str(saved))
+        return slot.name, lost
+
+    def release(self, client):
+        with self._cond:
+            slot = self._find(client)
+            if slot is not None:
+                slot.busy = False
+                slot.last_used = time.monotonic()
+            self._cond.notify_all()
+
+    def reset(self, client):
+        """Discard the workspace of *client* (e.g. on kernel restart)."""
+        with self._cond:
+            self._discard(client)
+            self._cond.notify_all()
+
+    def replace(self, client):
+        """Replace the (dead) engine leased to *client*."""
+        import matlab.engine
+
+        with self._cond:
+            slot = self._find(client)
+            if slot is None or not slot.busy:
+                raise BrokerError("No engine is leased")
+        new = self._share(matlab.engine.start_matlab())
+        with self._cond:
+            release_engine(slot.engine)
+            slot.name, slot.engine = new.name, new.engine
+        return slot.name
+
+    def disconnect(self, client):
+        with self._cond:
+            self._discard(client)
+            self._cond.notify_all()
+
+    def _discard(self, client):
+        self._lost.discard(client)
+        saved = self._saved.pop(client, None)
+        if saved is not None:
+            saved.unlink()
+        slot = self._find(client)
+        if slot is not None:
+            slot.owner = None
+            slot.busy = False
+            slot.dirty = True
+
+    def _call(self, slot, *args):
+        # Failures (e.g. a variable that cannot be saved) are reported but
+        # should not take the broker down.
+        try:
+            slot.engine.imatlab_workspace(*args, nargout=0)
+        except Exception as exc:
+            print("imatlab broker: {} failed on {}: {}".format(
+                args[0], slot.name, exc), file=sys.stderr)
+            return False
+        return True
+
+    def _save(self, slot, client):
+        path = self._state_dir / "{}.mat".format(client)
+        saved = self._call(slot, "save", str(path))
+        if not saved:
+            # The workspace must not leak to the next client.
+            self._call(slot, "clear")
+        with self._cond:
+            self._saving.discard(client)
+            if saved:
+                self._saved[client] = path
+            else:
+                self._lost.add(client)
+            self._cond.notify_all()
+
+    def _reap(self):
+        # Save the workspaces of idle clients, freeing their engines.
+        interval = min(self._idle_timeout / 4, 10)
+        while not self._closed:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self._cond:
+                reaped = [
+                    slot for slot in self._slots
+                    if slot.owner is not None and not slot.busy
+                    and now - slot.last_used > self._idle_timeout]
+                for slot in reaped:
+                    slot.busy = True
+                    self._saving.add(slot.owner)
+            for slot in reaped:
+                client = slot.owner
+                self._save(slot, client)
+                with self._cond:
+                    slot.owner = None
+                    slot.busy = False
+                    self._cond.notify_all()
+
+    def serve(self, listener):
+        """Serve clients from *listener* until `close` is called."""
+        self._address = listener.address
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                conn = None  # E.g. failed authentication.
+            if self._closed:
+                if conn is not None:
+                    conn.close()
+                return
+            if conn is None:
+                continue
+            threading.Thread(
+                target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn):
+        # Each client holds a single connection, so that leases are released
+        # when the kernel exits.
+        client = next(self._client_ids)
+        handlers = {"acquire": self.acquire, "release": self.release,
+                    "reset": self.reset, "replace": self.replace}
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(("ok", handlers[request](client)))
+                except Exception as exc:
+                    conn.send(("error", "{}: {}".format(
+                        type(exc).__name__, exc)))
+        finally:
+            self.disconnect(client)
+            conn.close()
+
+    def close(self):
+        self._closed = True
+        if self._address is not None:
+            try:  # Wake up `serve`.
+                Client(self._address).close()
+            except OSError:
+                pass
+        for slot in self._slots:
+            try:
+                slot.engine.exit()
+            except Exception:
+                pass
+        shutil.rmtree(str(self._state_dir), ignore_errors=True)
+
+
+class BrokerClient:
+    """A kernel's connection to the broker."""
+
+    def __init__(self, address):
+        self._conn = Client(address, authkey=_get_authkey())
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._name = None
+        # Set when the broker failed to save the workspace; reset by the user.
+        self.workspace_lost = False
+
+    def _request(self, request):
+        with self._lock:
+            self._conn.send(request)
+            status, value = self._conn.recv()
+        if status == "error":
+            raise BrokerError(value)
+        return value
+
+    @contextmanager
+    def lease(self):
+        """
+        Hold a lease (reentrantly) for the duration of the context, yielding
+        the name of the leased shared engine.
+        """
+        with self._lock:
+            if not self._depth:
+                self._name, lost = self._request("acquire")
+                self.workspace_lost |= lost
+            self._depth += 1
+            try:
+                yield self._name
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self._request("release")
+
+    def replace(self):
+        """Replace the currently leased (dead) engine; return its name."""
+        self._name = self._request("replace")
+        return self._name
+
+    def reset(self):
+        self._request("reset")
+
+    def close(self):
+        self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -mimatlab broker",
+        description="Lease shared MATLAB engines to imatlab kernels.")
+    parser.add_argument(
+        "--address", default=get_default_address(),
+        help="address to listen on (default: %(default)s)")
+    parser.add_argument(
+        "--size", type=int, default=2,
+        help="number of engines (default: %(default)s)")
+    parser.add_argument(
+        "--idle-timeout", type=float, default=600,
+        help="seconds after which the workspaces of idle kernels are saved "
+             "and their engines freed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if os.name == "posix" and os.path.exists(args.address):
+        os.unlink(args.address)  # Stale socket.
+    broker = Broker(args.size, idle_timeout=args.idle_timeout)
+    with Listener(args.address, authkey=_get_authkey(create=True)) as listener:
+        print("Listening on {}; set IMATLAB_BROKER to this address."
+              .format(args.address), flush=True)
+        try:
+            broker.serve(listener)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.close()
@@ -0,0 +1,47 @@
+"""
+A least-recently-used cache.
+"""
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A mapping which only keeps the most recently used entries, up to a total
+    size of *maxsize*.
+
+    The size of each entry is given by *sizeof(value)* (by default, 1).
+    """
+
+    def __init__(self, maxsize, sizeof=None):
+        self._maxsize = maxsize
+        self._sizeof = sizeof or (lambda value: 1)
+        self._data = OrderedDict()
+        self._size = 0
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self._size -= self._sizeof(self._data.pop(key))
+        self._data[key] = value
+        self._size += self._sizeof(value)
+        while self._size > self._maxsize:
+            _, old = self._data.popitem(last=False)
+            self._size -= self._sizeof(old)
+
+    def clear(self):
+        self._data.clear()
+        self._size = 0
@@ -0,0 +1,164 @@
+"""
+Python-side completion of MATLAB identifiers.
+
+Workspace variables and struct fields are reported by `imatlab_execute_cell`
+after each cell; functions are found by scanning the directories on the MATLAB
+path (in a background thread, whenever the path or the current directory
+change, or files are added to or removed from these directories).  Requests that cannot be answered from the index (command syntax,
+strings, methods, etc.) are left to MATLAB.
+"""
+
+from bisect import bisect_left
+import os
+import re
+import threading
+import time
+
+
+KEYWORDS = [
+    "break", "case", "catch", "classdef", "continue", "else", "elseif", "end",
+    "for", "function", "global", "if", "otherwise", "parfor", "persistent",
+    "return", "spmd", "switch", "try", "while",
+]
+_FUNCTION_EXTENSIONS = (".m", ".p", ".mlx", ".mlapp")
+# Minimum interval, in seconds, between checks for files added to or removed
+# from the scanned directories.
+_MTIME_CHECK_INTERVAL = 1
+
+
+class PrefixIndex:
+    """A sorted set of names, supporting prefix queries by bisection."""
+
+    def __init__(self, names=()):
+        self._names = sorted(set(names))
+
+    def __len__(self):
+        return len(self._names)
+
+    def startswith(self, prefix):
+        """Return the (sorted) names starting with *prefix*."""
+        if not prefix:
+            return list(self._names)
+        lo = bisect_left(self._names, prefix)
+        hi = bisect_left(self._names,
+                         prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+        return self._names[lo:hi]
+
+
+def scan_path(dirs):
+    """Return the names of the functions and classes found in *dirs*."""
+    names = set()
+    for d in dirs:
+        try:
+            entries = os.listdir(d)
+        except OSError:
+            continue
+        for entry in entries:
+            stem, ext = os.path.splitext(entry)
+            if entry.startswith("@"):  # Class folder.
+                names.add(entry[1:])
+            elif ext in _FUNCTION_EXTENSIONS or ext.startswith(".mex"):
+                names.add(stem)
+    return names
+
+
+def get_mtimes(dirs):
+    """
+    Return the modification times of *dirs* (which change whenever files are
+    added or removed), or None for directories that cannot be accessed.
+    """
+    mtimes = []
+    for d in dirs:
+        try:
+            mtimes.append(os.stat(d).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+class CompletionIndex:
+    def __init__(self):
+        self._variables = PrefixIndex()
+        self._fields = {}
+        self._functions = None  # Set once the path has been scanned.
+        self._path_state = None
+        # The scanned directories, and their modification times at that time.
+        self._dirs = []
+        self._mtimes = []
+        self._mtimes_checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update_workspace(self, variables, fields):
+        self._variables = PrefixIndex(variables)
+        self._fields = {name: PrefixIndex(names)
+                        for name, names in fields.items()}
+
+    def update_path(self, state, get_dirs):
+        """
+        Rescan the path in the background if *state* (an opaque value which
+        changes whenever the path or the current directory change) changed.
+
+        *get_dirs* is called (synchronously) to get the directories to scan.
+        """
+        if state == self._path_state:
+            return
+        self._path_state = state
+        self._scan(state, get_dirs())
+
+    def _scan(self, state, dirs):
+        def target():
+            mtimes = get_mtimes(dirs)  # Before, so as not to miss changes.
+            functions = PrefixIndex(scan_path(dirs).union(KEYWORDS))
+            with self._lock:
+                if self._path_state == state:
+                    self._functions = functions
+                    self._dirs = dirs
+                    self._mtimes = mtimes
+
+        threading.Thread(target=target, daemon=True).start()
+
+    def _check_mtimes(self):
+        # Files may be added to the path directories (e.g., a function saved
+        # to the current directory) without the path changing; if so, rescan
+        # (and leave completions to MATLAB meanwhile).
+        now = time.monotonic()
+        if now - self._mtimes_checked < _MTIME_CHECK_INTERVAL:
+            return
+        self._mtimes_checked = now
+        with self._lock:
+            state, dirs, mtimes = self._path_state, self._dirs, self._mtimes
+        if get_mtimes(dirs) != mtimes:
+            with self._lock:
+                if self._path_state == state:
+                    self._functions = None
+            self._scan(state, dirs)
+
+    def complete(self, code):
+        """
+        Return ``(cursor_start, matches)`` for the token ending *code*, or
+        None if the index cannot answer the request.
+        """
+        line = code.rsplit("\n", 1)[-1]
+        if "'" in line or '"' in line:  # Possibly within a string.
+            return None
+        match = re.search(r"(?:\b([a-zA-Z]\w*)\.)?(\w*)\Z", line)
+        name, prefix = match.groups()
+        before = line[:match.start()]
+        start = len(code) - len(prefix)
+        if name is not None:
+            if before.endswith(".") or name not in self._fields:
+                return None
+            return start, self._fields[name].startswith(prefix)
+        self._check_mtimes()
+        functions = self._functions
+        if (not re.match(r"[a-zA-Z]", prefix)
+                or functions is None
+                # Only complete in expression context (not command syntax).
+                or not re.search(
+                    r"(?:\A|[=(\[{,;+\-*/\\^&|~<>:@!]"
+                    r"|\b(?:if|elseif|while|switch|case|for \w+ ?=))\s*\Z",
+                    before)):
+            return None
+        matches = sorted(set(self._variables.startswith(prefix)).union(
+            functions.startswith(prefix)))
+        return (start, matches) if matches else None
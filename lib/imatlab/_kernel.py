@@ -1,16 +1,26 @@
+import asyncio
+import atexit
 import base64
-from contextlib import ExitStack
+from bisect import bisect_right
+from contextlib import contextmanager, ExitStack
 from distutils.version import LooseVersion
+from fnmatch import fnmatchcase
+import functools
+import hashlib
+import inspect
 from io import StringIO
+from itertools import islice
 import json
 import os
 from pathlib import Path
 import re
-import subprocess
+import shutil
+import signal
+import struct
 import sys
 from tempfile import TemporaryDirectory
+import threading
 import time
-from unittest.mock import patch
 import uuid
 import weakref
 from xml.etree import ElementTree as ET
@@ -20,54 +30,41 @@ try:
 except ImportError:
     import importlib_metadata as _importlib_metadata
 
+from ipykernel.comm import CommManager
 import ipykernel.kernelspec
 from ipykernel.kernelbase import Kernel
-import IPython
-from IPython.core.interactiveshell import InteractiveShell
+
+from . import _probe
 
 # Work around LD_PRELOAD tricks played by MATLAB by looking for a working
-# import order.
+# import order (cached across kernel startups).  plotly is only needed for
+# plotly figures, and thus imported on first use (see `_get_plotly`), unless
+# it must be imported before matlab.engine.
+_import_order = _probe.get_import_order()
 plotly = None
-try:
-    _plotly_version = LooseVersion(_importlib_metadata.version("plotly"))
-except _importlib_metadata.PackageNotFoundError:
-    _plotly_version = "0"
-if _plotly_version >= "1.13":  # First version to test Py3.5.
-    if subprocess.call(
-            [sys.executable, "-c", "import plotly, matlab.engine"],
-            stderr=subprocess.DEVNULL) == 0:
-        import plotly
-        import matlab.engine
-        from matlab.engine import EngineError, MatlabExecutionError
-    elif subprocess.call(
-            [sys.executable, "-c", "import matlab.engine, plotly"],
-            stderr=subprocess.DEVNULL) == 0:
-        import matlab.engine
-        from matlab.engine import EngineError, MatlabExecutionError
-        import plotly
-    else:
-        import matlab.engine
-        from matlab.engine import EngineError, MatlabExecutionError
-else:
-    import matlab.engine
-    from matlab.engine import EngineError, MatlabExecutionError
+if _import_order[0] == "plotly":
+    import plotly
+import matlab.engine
+from matlab.engine import EngineError, MatlabExecutionError
 
-from . import _redirection, __version__
+from . import (
+    _cache, _completion, _output, _paths, _png, _pool, _redirection, _syntax,
+    _timing, _watchdog, __version__)
 
 
-try:
-    _notebook_version = LooseVersion(_importlib_metadata.version("notebook"))
-except _importlib_metadata.PackageNotFoundError:
-    _notebook_version = None
-_PLOTLY_WARNING = (
-    # https://github.com/jupyter/notebook/issues/2287
-    "Plotly output is not supported with notebook==5.0.0.  "
-    "Please update to a newer version."
-    if _notebook_version == "5.0.0" else
-    "Failed to import both matlab.engine and plotly in the same process; "
-    "plotly output is unavailable."
-    if plotly is None else
-    None)
+# ipykernel>=6 awaits handlers that return awaitables.
+_ASYNC_HANDLERS = ipykernel.version_info >= (6,)
+# Maximum delay before noticing that a cell was interrupted.
+_POLL_INTERVAL = .1
+# Cells at least this long, or containing loops, are run from script files
+# (which MATLAB's JIT handles better than eval'd strings).
+_SCRIPT_MIN_SIZE = 2 ** 10
+# Scripts unused for this long (in seconds) are deleted.
+_SCRIPT_MAX_AGE = 7 * 24 * 3600
+# Delay after which an idle engine which does not respond is reported as hung.
+_PING_TIMEOUT = 10
+# Workspace checkpoints not updated for this long (in seconds) are deleted.
+_CHECKPOINT_MAX_AGE = 7 * 24 * 3600
 
 
 # Support `python -mimatlab install`.
@@ -81,53 +78,352 @@ ipykernel.kernelspec.get_kernel_dict = lambda extra_arguments=None: {
 }
 
 
+@functools.lru_cache()
+def _get_plotly_warning():
+    # Why plotly output is unavailable, if it is; only checked once a plotly
+    # figure is exported.
+    try:
+        notebook_version = LooseVersion(
+            _importlib_metadata.version("notebook"))
+    except _importlib_metadata.PackageNotFoundError:
+        notebook_version = None
+    return (
+        # https://github.com/jupyter/notebook/issues/2287
+        "Plotly output is not supported with notebook==5.0.0.  "
+        "Please update to a newer version."
+        if notebook_version == "5.0.0" else
+        "Failed to import both matlab.engine and plotly in the same process; "
+        "plotly output is unavailable."
+        if "plotly" not in _import_order else
+        None)
+
+
+def _get_plotly():
+    global plotly
+    if plotly is None:
+        import plotly
+    return plotly
+
+
+def _to_bytes(array):
+    # Avoid per-element conversion of MATLAB arrays: recent engines expose a
+    # memoryview, older ones store the data in an `array.array`.
+    try:
+        return array.tomemoryview().tobytes()
+    except AttributeError:
+        return array._data.tobytes()
+
+
 class MatlabHistory:
     # The MATLAB GUI relies on `History.xml` (which uses a ridiculously fragile
     # parser); the command line (-nodesktop) interface on `history.m`.  We read
     # the former but update both files.
+    #
+    # Previous sessions are only read (streamed into a flat list of commands
+    # and a list of session start indices) when history is first requested.
+    #
+    # Writes are buffered and flushed at most every `_flush_delay` seconds (and
+    # at exit).  `History.xml` is never rewritten: new commands are written
+    # over the closing tags of our own session, which are then written again.
+
+    _flush_delay = 2
 
     def __init__(self, prefdir):
         self._prefdir = prefdir
-        self._as_list = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending_xml = []
+        self._pending_m = []
+        # Offset of our session's closing tag, and expected file size.
+        self._xml_offset = self._xml_size = None
+        self._has_xml = (prefdir / "History.xml").exists()
+        self._time_stamp = int(time.time() * 1000)
+        command = ET.Element(
+            "command", {"time_stamp": format(self._time_stamp, "x")})
+        command.text = time.strftime("%%-- %m/%d/%Y %I:%M:%S %p --%%")
+        command.tail = "\n"
+        self._header = ET.tostring(command, "utf-8")
+        self._current = [command.text] if self._has_xml else []
+        # Loaded lazily.
+        self._texts = self._session_starts = None
+        atexit.register(self.flush)
+
+    def _load(self):
+        texts = []
+        session_starts = []
         try:
-            self._et = ET.parse(str(prefdir / "History.xml"))
-            root = self._et.getroot()
-            self._session = ET.SubElement(root, "session")
-            self._session.text = "\n"
-            self._session.tail = "\n"
-            command = ET.SubElement(
-                self._session, "command",
-                {"time_stamp": format(int(time.time() * 1000), "x")})
-            command.text = time.strftime("%%-- %m/%d/%Y %I:%M:%S %p --%%")
-            command.tail = "\n"
-            self._as_list.extend(
-                (session_number, line_number, elem.text)
-                for session_number, session in enumerate(list(root), 1)
-                for line_number, elem in enumerate(session, 1))
-        except FileNotFoundError:
-            self._et = self._session = None
+            context = ET.iterparse(
+                str(self._prefdir / "History.xml"), ("start", "end"))
+            event, root = next(context)
+            for event, elem in context:
+                if event == "start" and elem.tag == "session":
+                    session_starts.append(len(texts))
+                elif event == "end" and elem.tag == "command":
+                    time_stamp = elem.get("time_stamp")
+                    if (time_stamp is not None
+                            and int(time_stamp, 16) >= self._time_stamp):
+                        # Our own session, or a later one: stop here.
+                        del texts[session_starts.pop():]
+                        break
+                    texts.append(elem.text or "")
+                elif event == "end" and elem.tag == "session":
+                    root.clear()
+        except (FileNotFoundError, StopIteration, ET.ParseError):
+            pass
+        self._texts = texts
+        self._session_starts = session_starts
+
+    @property
+    def session_number(self):
+        if self._texts is None:
+            self._load()
+        return len(self._session_starts) + 1
+
+    def _get_entry(self, idx):
+        # *idx* indexes the concatenation of previous sessions and ours.
+        if idx >= len(self._texts):
+            return (self.session_number, idx - len(self._texts) + 1,
+                    self._current[idx - len(self._texts)])
+        session = bisect_right(self._session_starts, idx)
+        return (session, idx - self._session_starts[session - 1] + 1,
+                self._texts[idx])
+
+    def _iter_reversed(self):
+        if self._texts is None:
+            self._load()
+        return map(self._get_entry,
+                   reversed(range(len(self._texts) + len(self._current))))
+
+    def get_tail(self, n=None):
+        """Return the last *n* entries (all entries if *n* is None)."""
+        return list(islice(self._iter_reversed(), n))[::-1]
+
+    def get_range(self, session=0, start=1, stop=None):
+        """
+        Return lines *start* (included) to *stop* (excluded) of *session*.
+
+        Non-positive session numbers are relative to the current session.
+        """
+        current = self.session_number
+        if session <= 0:
+            session += current
+        if not 0 < session <= current:
+            return []
+        if session == current:
+            first = len(self._texts)
+            last = first + len(self._current)
+        else:
+            first = self._session_starts[session - 1]
+            last = (self._session_starts[session] if session < current - 1
+                    else len(self._texts))
+        start = max(start or 1, 1)
+        stop = min(stop or last - first + 1, last - first + 1)
+        return [self._get_entry(idx)
+                for idx in range(first + start - 1, first + stop - 1)]
+
+    def search(self, pattern="*", n=None, unique=False):
+        """
+        Return the last *n* entries matching glob *pattern* (all if *n* is
+        None), dropping earlier duplicates if *unique* is set.
+        """
+        matches = (entry for entry in self._iter_reversed()
+                   if fnmatchcase(entry[2], pattern))
+        if unique:
+            seen = set()
+            matches = (entry for entry in matches
+                       if not (entry[2] in seen or seen.add(entry[2])))
+        return list(islice(matches, n))[::-1]
 
     def append(self, text, elapsed, success):
-        if self._et is not None:
-            command = ET.SubElement(
-                self._session, "command",
-                {"execution_time": str(int(elapsed * 1000)),
-                 **({} if success else {"error": "true"})})
-            command.text = text
-            command.tail = "\n"
-            last_session, last_line, _ = self._as_list[-1]
-            self._as_list.append((last_session, last_line + 1, text))
-            with (self._prefdir / "History.xml").open("r+b") as file:
-                next(file)  # Skip the XML declaration, which is fragile.
-                file.truncate()
-                self._et.write(file, "utf-8", xml_declaration=False)
-        with (self._prefdir / "history.m").open("a") as file:
-            file.write(text)
-            file.write("\n")
+        with self._lock:
+            if self._has_xml:
+                command = ET.Element(
+                    "command",
+                    {"execution_time": str(int(elapsed * 1000)),
+                     **({} if success else {"error": "true"})})
+                command.text = text
+                command.tail = "\n"
+                self._pending_xml.append(ET.tostring(command, "utf-8"))
+                self._current.append(text)
+            self._pending_m.append(text + "\n")
+            if self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            xml = b"".join(self._pending_xml)
+            m = "".join(self._pending_m)
+            self._pending_xml = []
+            self._pending_m = []
+            if xml:
+                self._write_xml(xml)
+            if m:
+                with (self._prefdir / "history.m").open("a") as file:
+                    file.write(m)
+
+    def _write_xml(self, data):
+        with (self._prefdir / "History.xml").open("r+b") as file:
+            size = file.seek(0, os.SEEK_END)
+            if size == self._xml_size:
+                offset = self._xml_offset
+            else:
+                # First write, or someone else (e.g. the MATLAB GUI) modified
+                # the file: start a new session before the root closing tag.
+                file.seek(max(size - 4096, 0))
+                tail = file.read()
+                idx = tail.rfind(b"</history>")
+                if idx == -1:  # Not something we know how to update.
+                    return
+                offset = size - len(tail) + idx
+                data = b"<session>\n" + self._header + data
+            file.seek(offset)
+            file.write(data)
+            self._xml_offset = file.tell()
+            file.write(b"</session>\n</history>")
+            file.truncate()
+            self._xml_size = file.tell()
+
+
+# Numpy dtypes (and `struct` format characters, for scalars) of MATLAB numeric
+# arrays sent by `VariableInspector` (logical arrays are sent as uint8).
+_DTYPES = {
+    "double": ("float64", "d"), "single": ("float32", "f"),
+    "logical": ("bool", "B"),
+    "int8": ("int8", "b"), "uint8": ("uint8", "B"),
+    "int16": ("int16", "h"), "uint16": ("uint16", "H"),
+    "int32": ("int32", "i"), "uint32": ("uint32", "I"),
+    "int64": ("int64", "q"), "uint64": ("uint64", "Q"),
+}
 
-    @property
-    def as_list(self):
-        return self._as_list
+
+def _leasing(method):
+    """Hold the engine lease (see `MatlabKernel._leased`) during *method*."""
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._leased():
+                return (yield from method(self, *args, **kwargs))
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._leased():
+                return method(self, *args, **kwargs)
+    return wrapper
+
+
+class VariableInspector:
+    """
+    Expose the base workspace through ``imatlab.variables`` comms.
+
+    Frontends send ``{"method": "list"}`` to get the ``whos`` metadata of all
+    variables, and ``{"method": "fetch", "name": ..., "rows": [start, stop],
+    "cols": [start, stop]}`` (0-based, half-open, defaulting to the first
+    1000 rows and 100 columns) to get a block of a variable (reshaped to two
+    dimensions).  Numeric blocks are sent as raw row-major buffers (real part,
+    then imaginary part if any) in native byte order, which can be wrapped
+    e.g. with `numpy.frombuffer`; other blocks are sent as displayed text.
+    After each cell, an ``"update"`` message lists the variables that were
+    changed or removed, so that frontends only need to re-fetch these.
+    """
+
+    target_name = "imatlab.variables"
+
+    def __init__(self, kernel):
+        self._kernel = kernel
+        self._comms = {}
+        self._signatures = {}
+
+    def open(self, comm, msg):
+        self._comms[comm.comm_id] = comm
+        comm.on_msg(self._handle_msg)
+        comm.on_close(lambda msg: self._comms.pop(comm.comm_id, None))
+        comm.send({"method": "list", "variables": self._list()})
+
+    def reset(self):
+        """Forget the known variables, e.g. after an engine restart."""
+        self._signatures = {}
+
+    def _list(self):
+        with self._kernel._leased():
+            info = self._kernel._engine.imatlab_variables(
+                "list", nargout=1, stdout=StringIO(), stderr=StringIO())
+        variables = [
+            {"name": name, "class": cls, "shape": [int(n) for n in size[0]],
+             "bytes": int(nbytes), "complex": bool(is_complex),
+             "signature": signature}
+            for name, cls, size, nbytes, is_complex, signature in zip(
+                info["names"], info["classes"], info["sizes"],
+                info["bytes"], info["complex"], info["signatures"])]
+        self._signatures = {
+            variable["name"]: variable["signature"] for variable in variables}
+        return variables
+
+    def update(self):
+        """Notify the frontends of the variables modified by the last cell."""
+        if not self._comms:
+            return
+        old = self._signatures
+        variables = self._list()
+        changed = [
+            variable for variable in variables
+            if old.get(variable["name"]) != variable["signature"]]
+        removed = sorted(old.keys() - self._signatures.keys())
+        if changed or removed:
+            for comm in self._comms.values():
+                comm.send({"method": "update",
+                           "changed": changed, "removed": removed})
+
+    def _handle_msg(self, msg):
+        comm = self._comms[msg["content"]["comm_id"]]
+        data = msg["content"]["data"]
+        try:
+            if data.get("method") == "list":
+                comm.send({"method": "list", "variables": self._list()})
+            elif data.get("method") == "fetch":
+                content, buffers = self._fetch(
+                    data["name"], data.get("rows", [0, 1000]),
+                    data.get("cols", [0, 100]))
+                comm.send(content, buffers=buffers)
+            else:
+                raise ValueError(
+                    "Unknown method: {!r}".format(data.get("method")))
+        except (KeyError, ValueError, MatlabExecutionError) as exc:
+            comm.send({"method": "error", "request": data,
+                       "message": str(exc)})
+
+    def _fetch(self, name, rows, cols):
+        if not re.match(r"(?a)\A[a-zA-Z]\w*\Z", name):
+            raise ValueError("Invalid variable name: {!r}".format(name))
+        with self._kernel._leased():
+            page = self._kernel._engine.imatlab_variables(
+                "fetch", name,
+                float(rows[0] + 1), float(rows[1]),
+                float(cols[0] + 1), float(cols[1]),
+                nargout=1, stdout=StringIO(), stderr=StringIO())
+        content = {"method": "data", "name": name, "class": page["class"],
+                   "shape": [int(n) for n in page["size"][0]],
+                   "rows": rows, "cols": cols}
+        if "text" in page:
+            content["text"] = page["text"]
+            return content, []
+        dtype, fmt = _DTYPES[page["class"]]
+        buffers = []
+        for part in [page["real"], page["imag"]]:
+            if isinstance(part, (bool, int, float)):
+                # The engine converts 1x1 arrays to Python scalars.
+                part = struct.pack("=" + fmt, part)
+            else:
+                part = _to_bytes(part)
+            if part:
+                buffers.append(part)
+        content["dtype"] = dtype
+        content["complex"] = len(buffers) == 2
+        return content, buffers
 
 
 class MatlabKernel(Kernel):
@@ -146,11 +442,17 @@ class MatlabKernel(Kernel):
     def language_info(self):
         # We also hook this property to `cd` into the current directory if
         # required.
-        if self._call("getenv", "IMATLAB_CD"):
-            self._call("cd", str(Path().resolve()))
+        with self._leased():
+            self._eval(
+                "if ~isempty(builtin('getenv', 'IMATLAB_CD')), "
+                "builtin('cd', '{}'); end"
+                .format(str(Path().resolve()).replace("'", "''")),
+                nargout=0)
+            if self._matlab_version is None:
+                self._matlab_version = self._call("version")
         return {
             "name": "matlab",
-            "version": self._call("version"),
+            "version": self._matlab_version,
             "mimetype": "text/x-matlab",
             "file_extension": ".m",
             "pygments_lexer": "matlab",
@@ -166,58 +468,361 @@ class MatlabKernel(Kernel):
             r"\Akernel-\d+\Z",
             Path(self.config["IPKernelApp"]["connection_file"]).stem))
 
+        self._is_complete_cache = _cache.LRUCache(256)
+
+        self._timer = _timing.PhaseTimer()
+        try:
+            spill_dir = _paths.get_cache_dir() / "output"
+        except OSError:  # Excess output is then dropped.
+            spill_dir = None
+        self._output_limiter = _output.OutputLimiter(
+            int(os.environ.get("IMATLAB_OUTPUT_LIMIT") or 2 ** 22), spill_dir)
+
+        self.comm_manager = CommManager(parent=self, kernel=self)
+        for msg_type in ["comm_open", "comm_msg", "comm_close"]:
+            self.shell_handlers[msg_type] = getattr(
+                self.comm_manager, msg_type)
+        self._variable_inspector = VariableInspector(self)
+        self.comm_manager.register_target(
+            VariableInspector.target_name, self._variable_inspector.open)
+
+        # Exported figures are written here (and deleted once read).
+        self._export_dir = TemporaryDirectory()
+        # Scripts generated from cells, named after their contents' hash (and
+        # thus shared between kernels).  If the cache directory is unusable,
+        # all cells are eval'd.
+        try:
+            self._script_dir = _paths.get_cache_dir() / "cells"
+            self._script_dir.mkdir(exist_ok=True)
+        except OSError:
+            self._script_dir = None
+
+        self._plotly_initialized = False
+
+        self._pumps = []
         if os.name == "posix":
             with ExitStack() as stack:
                 for name in ["stdout", "stderr"]:
                     stream = getattr(sys, "__{}__".format(name))
-                    def callback(data, *, _name=name, _stream=stream):
+                    def callback(text, *, _name=name):
                         if not self._silent:
-                            self._send_stream(
-                                _name, data.decode(_stream.encoding))
-                    stack.enter_context(
-                        _redirection.redirect(stream.fileno(), callback))
+                            self._send_output(_name, text)
+                    self._pumps.append(stack.enter_context(
+                        _redirection.redirect(
+                            stream.fileno(), callback, stream.encoding)))
                 weakref.finalize(self, stack.pop_all().close)
 
-        self._dead_engines = []
+        # Held while the engine is in use, so that the watchdog only checks it
+        # between requests.
+        self._engine_lock = threading.RLock()
+        self._engine_warnings = []  # Reported at the next execution.
+        broker_address = os.environ.get("IMATLAB_BROKER")
+        if broker_address:
+            from . import _broker  # Only imported if needed.
+            self._broker = _broker.BrokerClient(broker_address)
+        else:
+            self._broker = None
+        # Workspace checkpoints (see `_sync_checkpoint`), named after the
+        # connection file, which is kept across restarts.  Not supported with
+        # a broker, which takes care of workspaces itself.
+        self._checkpoint_dir = None
+        self._checkpoint_future = None
+        self._checkpoint_skipped = set()
+        self._checkpoint_unhashed = set()
+        checkpoints_dir = None
+        if os.environ.get("IMATLAB_CHECKPOINT") and self._broker is None:
+            try:
+                checkpoints_dir = _paths.get_cache_dir() / "checkpoints"
+                checkpoints_dir.mkdir(exist_ok=True)
+            except OSError as exc:
+                self._engine_warnings.append(
+                    "Workspace checkpoints are disabled: {}\n".format(exc))
+                checkpoints_dir = None
+        if checkpoints_dir is not None:
+            now = time.time()
+            for path in checkpoints_dir.glob("*/manifest.mat"):
+                try:
+                    if now - path.stat().st_mtime > _CHECKPOINT_MAX_AGE:
+                        shutil.rmtree(str(path.parent))
+                except OSError:  # Concurrently deleted by another kernel.
+                    pass
+            self._checkpoint_dir = checkpoints_dir / Path(
+                self.config["IPKernelApp"]["connection_file"]).stem
+        self._restore_pending = self._has_checkpoint()
+        self._pool = _pool.EnginePool(
+            0 if self._broker else
+            int(os.environ.get("IMATLAB_POOL_SIZE") or 0))
+        self._engine_name = None
         engine_name = os.environ.get("IMATLAB_CONNECT")
-        if engine_name:
+        if self._broker:
+            pass  # The engine is connected to by `_leased`.
+        elif engine_name:
             if re.match(r"\A(?a)[a-zA-Z]\w*\Z", engine_name):
-                self._engine = matlab.engine.connect_matlab(engine_name)
+                self._set_engine(
+                    matlab.engine.connect_matlab(engine_name), owned=False)
             else:
-                self._engine = matlab.engine.connect_matlab()
+                self._set_engine(matlab.engine.connect_matlab(), owned=False)
         else:
-            self._engine = matlab.engine.start_matlab()
-        self._history = MatlabHistory(Path(self._call("prefdir")))
+            self._set_engine(self._pool.take())
+        with self._leased():
+            self._history = MatlabHistory(Path(self._call("prefdir")))
+        # The broker takes care of its own engines.
+        watchdog_interval = float(
+            os.environ.get("IMATLAB_WATCHDOG_INTERVAL") or 10)
+        self._watchdog = (
+            _watchdog.Watchdog(
+                self._engine_lock, self._check_engine, watchdog_interval)
+            if watchdog_interval > 0 and self._broker is None else None)
+
+    def _set_engine(self, engine, name=None, owned=True):
+        self._engine = engine
+        self._engine_name = name
+        # Whether the MATLAB process may be killed if the engine dies.
+        self._engine_owned = owned
+        self._engine_pid = int(self._call("feature", "getpid"))
+        self._matlab_version = None
+        self._has_mt_get_completions = None
+        self._completion_index = _completion.CompletionIndex()
+        # Help texts, bounded by total length, and invalidated whenever the
+        # path or the current directory change.
+        self._help_cache = _cache.LRUCache(2 ** 20, len)
+        self._path_state = None
+        self._variable_inspector.reset()
         self._engine.addpath(
             str(Path(sys.modules[__name__.split(".")[0]].__file__).
                 with_name("data")),
+            *([str(self._script_dir)] if self._script_dir else []),
             "-end")
 
+    @contextmanager
+    def _leased(self):
+        # With a broker, the engine is leased for the duration of each request
+        # (reentrantly), and may change between requests.
+        with self._engine_lock:
+            if self._broker is None:
+                yield
+                return
+            with self._broker.lease() as name:
+                if name != self._engine_name:
+                    self._set_engine(
+                        matlab.engine.connect_matlab(name), name, False)
+                if self._broker.workspace_lost:
+                    self._broker.workspace_lost = False
+                    self._engine_warnings.append(
+                        "The broker failed to save the workspace while the "
+                        "engine was leased to another kernel; it was lost.\n")
+                yield
+
+    def _replace_engine(self):
+        # Called once the engine died.
+        _watchdog.release_engine(
+            self._engine, self._engine_pid if self._engine_owned else None)
+        self._checkpoint_future = None
+        self._restore_pending = self._has_checkpoint()
+        if self._broker is None:
+            self._set_engine(self._pool.take())
+        else:
+            name = self._broker.replace()
+            self._set_engine(matlab.engine.connect_matlab(name), name, False)
+
+    def _check_engine(self):
+        # Called by the watchdog, while the engine is not in use.
+        if (self._checkpoint_future is not None
+                and not self._checkpoint_future.done()):
+            return  # Busy checkpointing.
+        future = self._call("version", background=True)
+        try:
+            future.result(_PING_TIMEOUT)
+        except matlab.engine.TimeoutError:
+            future.cancel()
+            self._engine_warnings.append(
+                "MATLAB did not respond for {} s while idle.\n"
+                .format(_PING_TIMEOUT))
+        except EngineError:
+            self._engine_warnings.append(
+                "MATLAB died while idle and was restarted; "
+                "the workspace was lost.\n")
+            self._replace_engine()
+
+    def _has_checkpoint(self):
+        return (self._checkpoint_dir is not None
+                and (self._checkpoint_dir / "manifest.mat").exists())
+
+    def _sync_checkpoint(self):
+        # Wait for the checkpoint started after the previous cell, then, if
+        # the engine was replaced, restore the last checkpoint into the new
+        # engine.  Like `_execute`, a generator yielding engine futures.
+        if self._checkpoint_future is not None:
+            result, exc = yield self._checkpoint_future
+            self._checkpoint_future = None
+            if exc is not None:
+                self._send_stream(
+                    "stderr",
+                    "Failed to checkpoint the workspace: {}\n".format(exc))
+            else:
+                skipped = set(result["skipped"])
+                if skipped - self._checkpoint_skipped:
+                    self._send_stream(
+                        "stderr",
+                        "These variables cannot be checkpointed: {}\n"
+                        .format(", ".join(sorted(skipped))))
+                self._checkpoint_skipped = skipped
+                unhashed = set(result["unhashed"])
+                if unhashed - self._checkpoint_unhashed:
+                    self._send_stream(
+                        "stderr",
+                        "Changes to these variables are only checkpointed if "
+                        "their class, size, or byte count changes: {}\n"
+                        .format(", ".join(sorted(unhashed))))
+                self._checkpoint_unhashed = unhashed
+        if self._restore_pending:
+            self._restore_pending = False
+            result, exc = yield self._engine.imatlab_checkpoint(
+                "restore", str(self._checkpoint_dir), nargout=1,
+                background=True, stdout=StringIO(), stderr=StringIO())
+            if exc is not None:
+                self._send_stream(
+                    "stderr",
+                    "Failed to restore the workspace checkpoint: {}\n"
+                    .format(exc))
+            else:
+                self._send_stream(
+                    "stderr",
+                    "Restored {} variable(s) from the workspace checkpoint.\n"
+                    .format(len(result["restored"])))
+                if result["failed"]:
+                    self._send_stream(
+                        "stderr",
+                        "Failed to restore: {}\n"
+                        .format(", ".join(result["failed"])))
+
+    def _start_checkpoint(self):
+        # Only variables that changed are saved; the next cell (or any other
+        # engine call) waits for the checkpoint to complete.
+        self._checkpoint_future = self._engine.imatlab_checkpoint(
+            "save", str(self._checkpoint_dir), nargout=1, background=True,
+            stdout=StringIO(), stderr=StringIO())
+
+    def _discard_checkpoint(self):
+        if self._checkpoint_future is not None:
+            self._wait(self._checkpoint_future)
+            self._checkpoint_future = None
+        self._restore_pending = False
+        if self._checkpoint_dir is not None:
+            shutil.rmtree(str(self._checkpoint_dir), ignore_errors=True)
+
+    def _send_output(self, stream, text):
+        # MATLAB's own output, subject to the per-cell limit.
+        text = self._output_limiter.filter(text)
+        if text:
+            self._send_stream(stream, text)
+
     def _send_stream(self, stream, text):
         self.send_response(self.iopub_socket,
                            "stream",
                            {"name": stream, "text": text})
 
-    def _send_display_data(self, data, metadata):
+    def _send_display_data(self, data, metadata, display_id=None,
+                           update=False):
         # ZMQDisplayPublisher normally handles the conversion of `None`
         # metadata to {}.
+        content = {"data": data, "metadata": metadata or {}}
+        if display_id is not None:
+            content["transient"] = {"display_id": display_id}
         self.send_response(self.iopub_socket,
-                           "display_data",
-                           {"data": data, "metadata": metadata or {}})
+                           "update_display_data" if update else "display_data",
+                           content)
+
+    def finish_metadata(self, parent, metadata, reply_content):
+        metadata = super().finish_metadata(parent, metadata, reply_content)
+        if parent["header"]["msg_type"] == "execute_request":
+            # Durations in seconds; see `_execute` and imatlab_execute_cell.
+            metadata["imatlab_timings"] = dict(self._timer.current)
+            # Bytes output by MATLAB, and dropped past the limit.
+            metadata["imatlab_output"] = dict(self._output_limiter.current)
+            usage = _watchdog.process_usage(self._engine_pid)
+            if usage is not None:
+                metadata["imatlab_engine"] = usage
+        return metadata
 
     def do_execute(
             self, code, silent, store_history=True,
             # Neither of these is supported.
             user_expressions=None, allow_stdin=False):
+        execution = self._execute(code, silent, store_history)
+        if _ASYNC_HANDLERS:
+            return self._run_execution_async(execution)
+        else:
+            return self._run_execution(execution)
 
+    # The cell is evaluated as an engine future, so that the kernel can keep
+    # handling control messages (with ipykernel>=6, which awaits coroutine
+    # handlers) and so that interrupts can be forwarded to MATLAB.  `_execute`
+    # is a generator which yields engine futures, and is sent back their
+    # outcomes as `(result, exception)` pairs.
+
+    def _run_execution(self, execution):
+        try:
+            future = next(execution)
+            while True:
+                future = execution.send(self._wait(future))
+        except StopIteration as stop:
+            return stop.value
+
+    async def _run_execution_async(self, execution):
+        try:
+            future = next(execution)
+            while True:
+                future = execution.send(await self._wait_async(future))
+        except StopIteration as stop:
+            return stop.value
+
+    @contextmanager
+    def _cancel_on_interrupt(self, future):
+        # Jupyter interrupts the kernel with SIGINT; cancel the MATLAB call
+        # instead of raising KeyboardInterrupt at an arbitrary point.
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        previous = signal.signal(
+            signal.SIGINT, lambda signum, frame: future.cancel())
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, previous)
+
+    def _wait(self, future):
+        with self._cancel_on_interrupt(future):
+            while True:
+                try:
+                    # Time out regularly to let the signal handler run.
+                    return future.result(_POLL_INTERVAL), None
+                except matlab.engine.TimeoutError:
+                    pass
+                except Exception as exc:
+                    return None, exc
+
+    async def _wait_async(self, future):
+        # The blocking wait returns as soon as the future completes (unlike
+        # polling `done()`); it runs in a thread, so the SIGINT handler is
+        # installed here, on the main thread.
+        with self._cancel_on_interrupt(future):
+            return await asyncio.get_event_loop().run_in_executor(
+                None, self._wait, future)
+
+    @_leasing
+    def _execute(self, code, silent, store_history):
         status = "ok"
         if silent:
             self._silent = True
         start = time.perf_counter()
-
-        # The debugger may have been set e.g. in startup.m (or later), but it
-        # interacts poorly with the engine.
-        self._call("dbclear", "all", nargout=0)
+        timer = self._timer
+        timer.start_cell()
+        self._output_limiter.start_cell()
+        while self._engine_warnings:
+            self._send_stream("stderr", self._engine_warnings.pop(0))
+        with timer.phase("checkpoint"):
+            yield from self._sync_checkpoint()
 
         # Don't include the "Error using eval" before each output.
         # This does not distinguish between `x` and `eval('x')` (with `x`
@@ -229,47 +834,89 @@ class MatlabKernel(Kernel):
                     me="ME{}".format(str(uuid.uuid4()).replace("-", ""))))
 
         if os.name == "posix":
-            try:
-                self._eval(try_code, nargout=0)
-            except (SyntaxError, MatlabExecutionError, KeyboardInterrupt):
-                status = "error"
-            except EngineError as engine_error:
-                # Check whether the engine died.
-                try:
-                    self._eval("1")
-                except EngineError:
-                    self._send_stream(
-                        "stderr",
-                        "Please quit the front-end (Ctrl-D from the console "
-                        "or qtconsole) to shut the kernel down.\n")
-                    # We don't want to GC the engines as that'll lead to an
-                    # attempt to close an already closed MATLAB during
-                    # `__del__`, which raises an uncatchable exception.  So
-                    # we just keep them around instead.
-                    self._dead_engines.append(self._engine)
-                    self._engine = matlab.engine.start_matlab()
-                else:
-                    raise engine_error
+            streams = {}
         elif os.name == "nt":
+            streams = {"stdout": StringIO(), "stderr": StringIO()}
+        else:
+            raise OSError("Unsupported OS")
+
+        with timer.phase("script"):
+            script = self._get_script(code)
+
+        # Clearing the debugger, evaluating the code, and exporting the
+        # figures are all done by a single call to `imatlab_execute_cell`.
+        exported = []
+        dump_timings = False
+        try:
+            engine_start = time.perf_counter()
+            result, exc = yield self._engine.imatlab_execute_cell(
+                "" if script else try_code,
+                "" if self._has_console_frontend else self._export_dir.name,
+                script,
+                nargout=1, background=True, **streams)
+            timer.add("engine", time.perf_counter() - engine_start)
+            if exc is not None:
+                raise exc
+        except (SyntaxError, MatlabExecutionError,
+                matlab.engine.CancelledError, KeyboardInterrupt):
+            status = "error"
+        except EngineError as engine_error:
+            # Check whether the engine died.
             try:
-                out = StringIO()
-                err = StringIO()
-                self._eval(try_code, nargout=0, stdout=out, stderr=err)
-            except (SyntaxError, MatlabExecutionError, KeyboardInterrupt):
-                status = "error"
-            finally:
-                for name, buf in [("stdout", out), ("stderr", err)]:
+                self._eval("1")
+            except EngineError:
+                self._send_stream(
+                    "stderr",
+                    "Please quit the front-end (Ctrl-D from the console "
+                    "or qtconsole) to shut the kernel down.\n")
+                self._replace_engine()
+            else:
+                raise engine_error
+        else:
+            status = result["status"]
+            exported = result["exported"]
+            # MATLAB-side phases (the "engine" phase includes them).
+            for phase, elapsed in result["timings"].items():
+                timer.add(phase, elapsed)
+            dump_timings = result["dump_timings"]
+            self._completion_index.update_workspace(
+                result["variables"], result["fields"])
+            self._completion_index.update_path(
+                result["path_state"],
+                lambda: [*(path for path
+                           in self._call("path").split(os.pathsep)
+                           if path != str(self._script_dir)),
+                         self._call("cd")])
+            if result["path_state"] != self._path_state:
+                self._path_state = result["path_state"]
+                self._help_cache.clear()
+        finally:
+            with timer.phase("flush"):
+                for pump in self._pumps:
+                    pump.flush()
+                for name, buf in streams.items():
                     v = buf.getvalue()
                     if v:
-                        self._send_stream(name, v)
-        else:
-            raise OSError("Unsupported OS")
+                        self._send_output(name, v)
+
+        with timer.phase("encode"):
+            self._export_figures(exported)
 
-        self._export_figures()
+        with timer.phase("variables"):
+            self._variable_inspector.update()
+
+        # Not while an empty replacement engine awaits restoration.
+        if self._checkpoint_dir is not None and not self._restore_pending:
+            self._start_checkpoint()
 
         if store_history and code:  # Skip empty lines.
             elapsed = time.perf_counter() - start
-            self._history.append(code, elapsed, status == "ok")
+            with timer.phase("history"):
+                self._history.append(code, elapsed, status == "ok")
+        timer.add("total", time.perf_counter() - start)
+        timer.end_cell()
+        if dump_timings:
+            self._send_stream("stderr", timer.format_stats())
         self._silent = False
 
         if status == "ok":
@@ -288,51 +935,111 @@ class MatlabKernel(Kernel):
                 "traceback": [],
             }
 
-    def _export_figures(self):
-        if (self._has_console_frontend
-                or not len(self._call("get", 0., "children"))
-                or not self._call("which", "imatlab_export_fig")):
-            return
-        with TemporaryDirectory() as tmpdir:
-            cwd = self._call("cd")
+    def _get_script(self, code):
+        """
+        Return the name of a script (on the MATLAB path) containing *code*,
+        or an empty string if *code* should be eval'd instead.
+        """
+        keywords = _syntax.block_keywords(code)
+        if (self._script_dir is None
+                or len(code) < _SCRIPT_MIN_SIZE
+                and not keywords & {"for", "parfor", "while"}
+                # Functions cannot be defined in eval'd code, but can in
+                # scripts; keep reporting the error.
+                or keywords & {"function", "classdef"}
+                or _syntax.is_complete(code) != "complete"):
+            return ""
+        try:
+            # The encoding of non-ASCII scripts depends on MATLAB's version
+            # and locale.
+            data = code.encode("ascii")
+        except UnicodeEncodeError:
+            return ""
+        name = "imatlab_cell_" + hashlib.sha1(data).hexdigest()
+        path = self._script_dir / (name + ".m")
+        try:
+            os.utime(str(path))  # Mark as used, see below.
+        except FileNotFoundError:
+            tmp_path = path.with_suffix(".{}.tmp".format(os.getpid()))
             try:
-                self._call("cd", tmpdir)
-                exported = self._engine.imatlab_export_fig()
-            finally:
-                self._call("cd", cwd)
-            for path in map(Path(tmpdir).joinpath, exported):
-                if path.suffix.lower() == ".html":
-                    if _PLOTLY_WARNING:
-                        self._send_stream("stderr", _PLOTLY_WARNING)
-                    else:
-                        self._plotly_init_notebook_mode()
-                        self._send_display_data(
-                            {"text/html": path.read_text()}, {})
-                elif path.suffix.lower() == ".png":
-                    self._send_display_data(
-                        {"image/png":
-                         base64.b64encode(path.read_bytes()).decode("ascii")},
-                        {})
-                elif path.suffix.lower() in ".jpeg":
-                    self._send_display_data(
-                        {"image/jpeg":
-                         base64.b64encode(path.read_bytes()).decode("ascii")},
-                        {})
-                elif path.suffix.lower() == ".svg":
-                    self._send_display_data(
-                        # Probably should read the encoding from the file.
-                        {"image/svg+xml": path.read_text(encoding="ascii")},
-                        {})
+                tmp_path.write_bytes(data + b"\n")
+                os.replace(str(tmp_path), str(path))
+            except OSError:  # E.g., disk full.
+                return ""
+            cutoff = time.time() - _SCRIPT_MAX_AGE
+            for old_path in self._script_dir.glob("imatlab_cell_*.m"):
+                try:
+                    if old_path.stat().st_mtime < cutoff:
+                        old_path.unlink()
+                except FileNotFoundError:  # Pruned by another kernel.
+                    pass
+        return name
+
+    def _export_figures(self, exported):
+        for entry in exported:
+            display_id = None
+            update = False
+            if isinstance(entry, dict) and "display_id" in entry:  # Kept.
+                display_id = entry["display_id"]
+                update = bool(entry["update"])
+                entry = entry.get("file", entry)
+            if isinstance(entry, dict):  # Rendered in memory.
+                data = {"image/png": base64.b64encode(_png.encode_png(
+                    _to_bytes(entry["data"]),
+                    int(entry["width"]), int(entry["height"])))
+                    .decode("ascii")}
+            else:
+                path = Path(self._export_dir.name, entry)
+                data = self._read_exported(path)
+                path.unlink()
+            if data:
+                self._send_display_data(data, {}, display_id, update)
+
+    def _read_exported(self, path):
+        if path.suffix.lower() == ".json":  # Plotly figure.
+            figure = json.loads(path.read_text(encoding="utf-8"))
+            data = {"application/vnd.plotly.v1+json": figure}
+            if not _get_plotly_warning():
+                # Fallback for frontends that do not render the json.
+                self._plotly_init_notebook_mode()
+                data["text/html"] = _get_plotly().offline.plot(
+                    figure, output_type="div", include_plotlyjs=False,
+                    show_link=False, validate=False)
+            return data
+        elif path.suffix.lower() == ".html":
+            warning = _get_plotly_warning()
+            if warning:
+                self._send_stream("stderr", warning)
+            else:
+                self._plotly_init_notebook_mode()
+                return {"text/html": path.read_text()}
+        elif path.suffix.lower() == ".png":
+            return {"image/png":
+                    base64.b64encode(path.read_bytes()).decode("ascii")}
+        elif path.suffix.lower() in ".jpeg":
+            return {"image/jpeg":
+                    base64.b64encode(path.read_bytes()).decode("ascii")}
+        elif path.suffix.lower() == ".svg":
+            # Probably should read the encoding from the file.
+            return {"image/svg+xml": path.read_text(encoding="ascii")}
 
     def _plotly_init_notebook_mode(self):
+        # Only load plotly.js once per session.
+        if self._plotly_initialized:
+            return
+        self._plotly_initialized = True
+        import IPython.core.display
+        from IPython.core.interactiveshell import InteractiveShell
+        from unittest.mock import patch
         # Hack into display routine.  Also pretend that the InteractiveShell is
         # initialized as display() is otherwise turned into a no-op.
         with patch.multiple(IPython.core.display,
                             publish_display_data=self._send_display_data), \
              patch.multiple(InteractiveShell,
                             initialized=lambda: True):
-            plotly.offline.init_notebook_mode()
+            _get_plotly().offline.init_notebook_mode()
 
+    @_leasing
     def do_complete(self, code, cursor_pos):
         code = code[:cursor_pos]
         reply = {
@@ -343,8 +1050,17 @@ class MatlabKernel(Kernel):
             "metadata": {},
         }
 
-        if ("mtGetCompletions"
-                in self._eval("methods(com.mathworks.jmi.MatlabMCR)")):
+        # Try to answer from the local index first.
+        local = self._completion_index.complete(code)
+        if local is not None:
+            reply["cursor_start"], reply["matches"] = local
+            return reply
+
+        if self._has_mt_get_completions is None:  # Check once per engine.
+            self._has_mt_get_completions = (
+                "mtGetCompletions"
+                in self._eval("methods(com.mathworks.jmi.MatlabMCR)"))
+        if self._has_mt_get_completions:
             # Use
             #
             #     String MatlabMCR.mtGetCompletions(String, int)
@@ -403,13 +1119,23 @@ class MatlabKernel(Kernel):
 
         return reply
 
+    @_leasing
     def do_inspect(self, code, cursor_pos, detail_level=0):
         try:
             token, = re.findall(r"\b[a-z]\w*(?=\(?\Z)", code[:cursor_pos])
         except ValueError:
             help = ""
         else:
-            help = self._engine.help(token)  # Not a builtin.
+            help = self._help_cache.get((token, detail_level))
+            if help is None:
+                help = self._engine.help(token)  # Not a builtin.
+                if detail_level:
+                    # `which` also describes variables, builtins, etc.
+                    source = self._call("which", token)
+                    if source:
+                        help = "{}\nSource: {}\n".format(
+                            help.rstrip("\n"), source).lstrip("\n")
+                self._help_cache[(token, detail_level)] = help
         return {
             "status": "ok",
             "found": bool(help),
@@ -420,9 +1146,36 @@ class MatlabKernel(Kernel):
     def do_history(
             self, hist_access_type, output, raw, session=None, start=None,
             stop=None, n=None, pattern=None, unique=False):
-        return {"history": self._history.as_list}
+        if hist_access_type == "tail":
+            history = self._history.get_tail(n)
+        elif hist_access_type == "range":
+            history = self._history.get_range(session or 0, start, stop)
+        elif hist_access_type == "search":
+            history = self._history.search(pattern or "*", n, unique)
+        else:
+            history = []
+        if output:  # Outputs are not recorded.
+            history = [(session, line, (text, None))
+                       for session, line, text in history]
+        return {"history": history}
 
     def do_is_complete(self, code):
+        status = self._is_complete_cache.get(code)
+        if status is None:
+            # Only ask MATLAB if the code is too tricky for `_syntax`.
+            status = (_syntax.is_complete(code)
+                      or self._matlab_is_complete(code))
+            self._is_complete_cache[code] = status
+        if status == "incomplete":
+            return {  # FIXME
+                "status": "incomplete",
+                "indent": "",
+            }
+        else:
+            return {"status": status}
+
+    @_leasing
+    def _matlab_is_complete(self, code):
         with TemporaryDirectory() as tmpdir:
             path = Path(tmpdir, "test_complete.m")
             path.write_text(code)
@@ -433,7 +1186,7 @@ class MatlabKernel(Kernel):
             # 'Parse error': unmatched keywords.
             if any(err.startswith(("Invalid syntax at",
                                    "Parse error at")) for err in errs):
-                return {"status": "invalid"}
+                return "invalid"
             # `mtree` returns a single node tree on parse error (but not
             # otherwise -- empty inputs give no nodes, expressions give two
             # nodes).  Given that we already excluded (some) errors earlier,
@@ -446,15 +1199,30 @@ class MatlabKernel(Kernel):
             incomplete = self._eval(
                 "builtin('numel', mtree('{}', '-file').indices) == 1"
                 .format(str(path).replace("'", "''")))
-            if incomplete:
-                return {  # FIXME
-                    "status": "incomplete",
-                    "indent": "",
-                }
-            else:
-                return {"status": "complete"}
+            return "incomplete" if incomplete else "complete"
 
     def do_shutdown(self, restart):
-        self._call("exit", nargout=0)
-        if restart:
-            self._engine = matlab.engine.start_matlab()
+        self._history.flush()
+        if self._broker is not None:
+            # The shared engine belongs to the broker.
+            if restart:
+                self._broker.reset()
+                self._engine_name = None  # Reset the caches on next lease.
+            else:
+                self._broker.close()
+            return
+        with self._engine_lock:
+            if restart:
+                # The new kernel process restores the workspace from the last
+                # checkpoint, which must thus be complete.
+                if self._checkpoint_future is not None:
+                    self._wait(self._checkpoint_future)
+                    self._checkpoint_future = None
+            else:
+                self._discard_checkpoint()
+            self._call("exit", nargout=0)
+            # Even when restarting, ipykernel exits the process after replying
+            # (and the new process starts its own engine).
+            if self._watchdog is not None:
+                self._watchdog.stop()
+            self._pool.close()
@@ -0,0 +1,93 @@
+"""
+Per-cell limit on the volume of MATLAB's output.
+"""
+
+import os
+from pathlib import Path
+import threading
+import time
+import uuid
+
+
+# Spilled output older than this (in seconds) is deleted.
+_SPILL_MAX_AGE = 7 * 24 * 3600
+
+
+class OutputLimiter:
+    """
+    Limit the output sent for each cell to *limit* bytes (UTF-8 encoded), or
+    not at all if *limit* is 0.
+
+    Past the limit, a marker is sent instead, and the rest of the cell's
+    output is appended to a file in *spill_dir* (or dropped, if *spill_dir*
+    is None or cannot be written to).  `current` holds the total and dropped
+    byte counts of the current cell, and the spill file's path.
+    """
+
+    def __init__(self, limit, spill_dir):
+        self._limit = limit
+        self._spill_dir = None if spill_dir is None else Path(spill_dir)
+        # Both streams are captured by separate threads.
+        self._lock = threading.Lock()
+        self.start_cell()
+
+    def start_cell(self):
+        with self._lock:
+            self.current = {"bytes": 0, "dropped": 0}
+            self._sent = 0
+            self._truncated = False
+            self._spill_path = None
+
+    def filter(self, text):
+        """
+        Return the part of *text* that should be sent (possibly empty, or
+        followed by the truncation marker).
+        """
+        with self._lock:
+            data = text.encode("utf-8", "replace")
+            self.current["bytes"] += len(data)
+            available = self._limit - self._sent
+            if not self._limit or len(data) <= available:
+                self._sent += len(data)
+                return text
+            # Don't split a multibyte character.
+            kept = data[:max(available, 0)].decode("utf-8", "ignore")
+            self._sent += len(kept.encode("utf-8"))
+            dropped = data[len(kept.encode("utf-8")):]
+            self.current["dropped"] += len(dropped)
+            marker = ""
+            if not self._truncated:
+                self._truncated = True
+                try:
+                    self._spill_path = self._new_spill_path()
+                except OSError:
+                    pass
+                if self._spill_path is None:
+                    destination = "dropped"
+                else:
+                    self.current["spill"] = str(self._spill_path)
+                    destination = "written to {}".format(self._spill_path)
+                marker = (
+                    "\n[Output truncated after {} bytes; the rest of this "
+                    "cell's output is {}]\n".format(self._limit, destination))
+            if self._spill_path is not None:
+                try:
+                    with self._spill_path.open("ab") as file:
+                        file.write(dropped)
+                except OSError:  # E.g., disk full; the output is just dropped.
+                    pass
+            return kept + marker
+
+    def _new_spill_path(self):
+        if self._spill_dir is None:
+            return None
+        self._spill_dir.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        for path in self._spill_dir.glob("output-*.txt"):
+            try:
+                if now - path.stat().st_mtime > _SPILL_MAX_AGE:
+                    path.unlink()
+            except OSError:  # Concurrently deleted by another kernel.
+                pass
+        return self._spill_dir / "output-{}-{}.txt".format(
+            os.getpid(), uuid.uuid4().hex[:8])
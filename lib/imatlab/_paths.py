@@ -0,0 +1,24 @@
+"""
+Locations of files written by imatlab.
+"""
+
+import os
+from pathlib import Path
+import sys
+
+
+def get_cache_dir():
+    """Return imatlab's (per-user) cache directory, creating it if needed."""
+    base = os.environ.get("IMATLAB_CACHE_DIR")
+    if base:
+        path = Path(base)
+    elif os.name == "nt":
+        path = Path(os.environ.get("LOCALAPPDATA")
+                    or Path.home() / "AppData/Local", "imatlab", "Cache")
+    elif sys.platform == "darwin":
+        path = Path.home() / "Library/Caches/imatlab"
+    else:
+        path = Path(os.environ.get("XDG_CACHE_HOME")
+                    or Path.home() / ".cache", "imatlab")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
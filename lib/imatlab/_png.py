@@ -0,0 +1,29 @@
+"""
+Minimal PNG encoder, for figures rendered to RGB buffers by MATLAB.
+"""
+
+import struct
+import zlib
+
+
+def _chunk(tag, body):
+    return (struct.pack(">I", len(body)) + tag + body
+            + struct.pack(">I", zlib.crc32(tag + body) & 0xffffffff))
+
+
+def encode_png(data, width, height):
+    """
+    Encode *data*, a bytes-like of row-major, 8-bit interleaved RGB values of
+    a *width* x *height* image, as PNG.
+    """
+    stride = 3 * width
+    data = memoryview(data)
+    # Each scanline is prefixed by its filter type (0: none).
+    raw = b"".join(b"\0" + data[i:i + stride]
+                   for i in range(0, stride * height, stride))
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+        _chunk(b"IDAT", zlib.compress(raw)),
+        _chunk(b"IEND", b""),
+    ])
@@ -0,0 +1,88 @@
+"""
+A pool of MATLAB engines started in the background.
+"""
+
+from collections import deque
+from threading import Lock
+
+import matlab.engine
+from matlab.engine import EngineError
+
+from ._watchdog import release_engine
+
+
+MAX_POOL_SIZE = 8
+# Pooled engines which may fail to start before `EnginePool.take` gives up
+# (e.g., if no license is available, every engine fails).
+MAX_FAILURES = 3
+
+
+class EnginePool:
+    """
+    Keep up to *size* MATLAB engines warm, starting in the background.
+
+    `take` returns a healthy engine (starting one synchronously if the pool is
+    empty, as it is initially) and then starts a replacement in the
+    background.  Thus, the first engine does not compete for startup with the
+    pooled ones.
+    """
+
+    def __init__(self, size):
+        self._size = max(0, min(size, MAX_POOL_SIZE))
+        self._futures = deque()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def refill(self):
+        with self._lock:
+            while len(self._futures) < self._size:
+                self._futures.append(
+                    matlab.engine.start_matlab(background=True))
+
+    def _pop(self):
+        with self._lock:
+            # Prefer engines that have finished starting.
+            for future in self._futures:
+                if future.done():
+                    self._futures.remove(future)
+                    return future
+            return self._futures.popleft() if self._futures else None
+
+    def take(self):
+        error = None
+        for _ in range(MAX_FAILURES):
+            future = self._pop()
+            if future is None:
+                engine = matlab.engine.start_matlab()
+                self.refill()
+                return engine
+            self.refill()
+            try:
+                engine = future.result()
+            except EngineError as exc:
+                error = exc
+                continue
+            try:
+                engine.builtin("version")  # Health check.
+            except EngineError as exc:
+                release_engine(engine)
+                error = exc
+                continue
+            return engine
+        raise error
+
+    def close(self):
+        with self._lock:
+            futures = list(self._futures)
+            self._futures.clear()
+            self._size = 0
+        for future in futures:
+            try:
+                if future.done():
+                    future.result().exit()
+                else:
+                    future.cancel()
+            except EngineError:
+                pass
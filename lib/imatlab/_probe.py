@@ -0,0 +1,96 @@
+"""
+Probe for an order in which plotly and matlab.engine can be imported.
+
+MATLAB plays LD_PRELOAD tricks which can prevent importing both modules in the
+same process, depending on the order in which they are imported.  Finding a
+working order requires spawning fresh interpreters, so the result is cached,
+keyed by the interpreter and the versions of both packages.
+"""
+
+from distutils.version import LooseVersion
+import json
+import os
+import subprocess
+import sys
+
+try:
+    import importlib.metadata as _importlib_metadata
+except ImportError:
+    import importlib_metadata as _importlib_metadata
+
+from ._paths import get_cache_dir
+
+
+_CACHE_NAME = "import_order.json"
+# Bumped when the probe changes, to invalidate cached results.
+_PROBE_VERSION = 2
+
+
+def _get_version(*dist_names):
+    for dist_name in dist_names:
+        try:
+            return _importlib_metadata.version(dist_name)
+        except _importlib_metadata.PackageNotFoundError:
+            pass
+    return None
+
+
+def _get_cache_key():
+    return {
+        "probe": _PROBE_VERSION,
+        "executable": sys.executable,
+        "plotly": _get_version("plotly"),
+        # Engines installed from the MATLAB tree use the latter name.
+        "matlabengine": _get_version("matlabengine", "matlabengineforpython"),
+    }
+
+
+def _probe(plotly_version):
+    if LooseVersion(plotly_version or "0") >= "1.13":  # First to test Py3.5.
+        # Prefer importing plotly last, so that the kernel can defer it.
+        for order in [["matlab.engine", "plotly"],
+                      ["plotly", "matlab.engine"]]:
+            if subprocess.call(
+                    [sys.executable, "-c", "import " + ", ".join(order)],
+                    stderr=subprocess.DEVNULL) == 0:
+                return order
+    return ["matlab.engine"]
+
+
+def get_import_order(refresh=False):
+    """
+    Return a list of module names, in an order in which they can be imported.
+
+    The list always contains ``"matlab.engine"``, and also ``"plotly"`` if it
+    is installed and can be imported together with the engine.  Unless
+    *refresh* is set, a cached result is returned if the interpreter and the
+    package versions did not change since it was computed.
+    """
+    key = _get_cache_key()
+    try:
+        path = get_cache_dir() / _CACHE_NAME
+    except OSError:  # E.g., read-only home directory; don't cache.
+        return _probe(key["plotly"])
+    try:
+        cache = json.loads(path.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    entry = cache.get(sys.executable)
+    if not refresh and entry and entry.get("key") == key:
+        return entry["order"]
+    order = _probe(key["plotly"])
+    cache[sys.executable] = {"key": key, "order": order}
+    tmp_path = path.with_name("{}.{}".format(path.name, os.getpid()))
+    try:
+        tmp_path.write_text(json.dumps(cache, indent=2))
+        os.replace(str(tmp_path), str(path))  # Atomic wrt. other kernels.
+    except OSError:
+        pass
+    return order
+
+
+def main():
+    order = get_import_order(refresh=True)
+    print("Import order: {}".format(", ".join(order)))
+    if "plotly" not in order:
+        print("plotly output is unavailable.")
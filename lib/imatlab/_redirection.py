@@ -5,37 +5,116 @@ Inspired from https://github.com/minrk/wurlitzer, but using sockets in order to
 support Windows.
 """
 
+import codecs
 from contextlib import contextmanager
 import os
 from selectors import DefaultSelector, EVENT_READ
-from threading import Thread
+from threading import Lock, Thread
 import socket
+import time
+
+
+class _Pump:
+    """
+    Forward data from a socket to a callback, from a separate thread.
+
+    Data is decoded incrementally (so that multibyte characters split across
+    reads are handled correctly) and coalesced: the callback is called when
+    *max_size* bytes are pending, or *max_delay* seconds after the oldest
+    pending data was received, or when `flush` is called.
+    """
+
+    def __init__(self, sock, callback, encoding, max_size, max_delay):
+        self._sock = sock
+        self._callback = callback
+        self._decoder = codecs.getincrementaldecoder(encoding)("replace")
+        self._max_size = max_size
+        self._max_delay = max_delay
+        self._chunks = []
+        self._size = 0
+        self._deadline = None
+        self._lock = Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._selector = DefaultSelector()
+        self._selector.register(self._sock, EVENT_READ)
+        self._selector.register(self._wake_r, EVENT_READ)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        # Read all available data; return False on EOF.
+        while True:
+            try:
+                data = self._sock.recv(self._max_size)
+            except (BlockingIOError, InterruptedError):
+                return True
+            if not data:
+                return False
+            self._chunks.append(self._decoder.decode(data))
+            self._size += len(data)
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self._max_delay
+            if self._size >= self._max_size:
+                self._emit()
+
+    def _emit(self):
+        text = "".join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        self._deadline = None
+        if text:
+            self._callback(text)
+
+    def _run(self):
+        while True:
+            timeout = (None if self._deadline is None
+                       else max(self._deadline - time.monotonic(), 0))
+            ready = {key.fileobj for key, _ in self._selector.select(timeout)}
+            with self._lock:
+                is_open = self._sock not in ready or self._drain()
+                if (not is_open or self._deadline is not None
+                        and time.monotonic() >= self._deadline):
+                    self._emit()
+            if not is_open or self._wake_r in ready:
+                return
+
+    def flush(self):
+        """Synchronously forward all data written so far."""
+        with self._lock:
+            self._drain()
+            self._emit()
+
+    def close(self):
+        self._wake_w.send(b"\0")
+        self._thread.join()
+        with self._lock:
+            self._drain()
+            self._chunks.append(self._decoder.decode(b"", True))
+            self._emit()
+        self._selector.close()
+        for sock in [self._sock, self._wake_r, self._wake_w]:
+            sock.close()
 
 
 @contextmanager
-def redirect(fd, callback):
+def redirect(fd, callback, encoding, *, max_size=2 ** 16, max_delay=.05):
+    """
+    Redirect writes to *fd* to *callback*, which is called with decoded text.
+
+    Output is coalesced (see `_Pump`); the yielded object has a ``flush``
+    method which forwards all pending output.
+    """
     save_fd = os.dup(fd)
 
     s_in, s_out = socket.socketpair()
     os.dup2(s_in.fileno(), fd)
-    os.close(s_in.fileno())
+    s_in.close()
     s_out.setblocking(False)
 
-    sel = DefaultSelector()
-    sel.register(s_out, EVENT_READ)
-
-    def target():
-        while running:
-            _, = sel.select()  # There's only one event.
-            callback(s_out.recv(4096))
-
-    running = True
-    thread = Thread(target=target, daemon=True)
-    thread.start()
-
+    pump = _Pump(s_out, callback, encoding, max_size, max_delay)
     try:
-        yield
+        yield pump
     finally:
-        running = False
         os.dup2(save_fd, fd)
         os.close(save_fd)
+        pump.close()
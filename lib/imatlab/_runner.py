@@ -0,0 +1,275 @@
+"""
+Headless execution of notebooks and scripts.
+
+Run it with ``python -mimatlab run [-j N] [-o DIR] FILE...``.  Notebooks
+(``.ipynb``) and scripts (``.m``, split into cells at ``%%`` lines) are
+executed by *N* worker processes, each of which runs a `MatlabKernel` (and
+thus exports figures as the notebook front-end would) and keeps its engine
+across files, clearing its state in between.  Executed notebooks, with their
+outputs and per-cell timings, are written to DIR, together with a
+``summary.json`` report.
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import multiprocessing
+from multiprocessing.util import Finalize
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+
+_SUMMARY_NAME = "summary.json"
+
+
+def split_script(text):
+    """Split the contents of a ``.m`` script into cells at ``%%`` lines."""
+    cells = [[]]
+    for line in text.splitlines(keepends=True):
+        if re.match(r"\s*%%(\s|\Z)", line) and cells[-1]:
+            cells.append([])
+        cells[-1].append(line)
+    return ["".join(cell).rstrip("\n") for cell in cells
+            if "".join(cell).strip()]
+
+
+def _new_code_cell(source):
+    return {"cell_type": "code", "execution_count": None, "metadata": {},
+            "outputs": [], "source": source}
+
+
+def read_notebook(path):
+    """
+    Read the notebook (or the ``.m`` script) at *path*, as a nbformat 4
+    dict.
+    """
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".m":
+        return {
+            "cells": [_new_code_cell(source) for source in split_script(text)],
+            "metadata": {
+                "kernelspec": {"name": "imatlab", "display_name": "MATLAB",
+                               "language": "matlab"},
+                "language_info": {"name": "matlab", "file_extension": ".m",
+                                  "mimetype": "text/x-matlab"},
+            },
+            "nbformat": 4,
+            "nbformat_minor": 2,
+        }
+    notebook = json.loads(text)
+    if notebook.get("nbformat") != 4:
+        raise ValueError("Only nbformat 4 notebooks are supported")
+    return notebook
+
+
+def _make_kernel_class():
+    # Deferred, so that the parent process imports neither ipykernel nor
+    # matlab.engine.
+    from ._kernel import MatlabKernel
+
+    class BatchKernel(MatlabKernel):
+        """
+        A kernel which records its outputs in nbformat format instead of
+        sending them.
+        """
+
+        def __init__(self, *args, **kwargs):
+            self._outputs = []
+            self._displays = {}  # Display id -> outputs, for updates.
+            super().__init__(*args, **kwargs)
+            self._loop = asyncio.new_event_loop()
+
+        def send_response(self, stream, msg_or_type, content=None, *args,
+                          **kwargs):
+            outputs = self._outputs
+            if msg_or_type == "stream":
+                if (outputs and outputs[-1]["output_type"] == "stream"
+                        and outputs[-1]["name"] == content["name"]):
+                    outputs[-1]["text"] += content["text"]
+                else:
+                    outputs.append({"output_type": "stream",
+                                    "name": content["name"],
+                                    "text": content["text"]})
+            elif msg_or_type in ["display_data", "update_display_data"]:
+                display_id = content.get("transient", {}).get("display_id")
+                if msg_or_type == "update_display_data":
+                    for output in self._displays.get(display_id, []):
+                        output.update(data=content["data"],
+                                      metadata=content["metadata"])
+                    return
+                output = {"output_type": "display_data",
+                          "data": content["data"],
+                          "metadata": content["metadata"]}
+                outputs.append(output)
+                if display_id is not None:
+                    self._displays.setdefault(display_id, []).append(output)
+
+        def reset(self, cwd, exporter):
+            """Clear the engine's state, before running a new notebook."""
+            with self._leased():
+                self._discard_checkpoint()
+                self._engine.imatlab_workspace("clear", nargout=0)
+                self._call("cd", str(cwd))
+                self._engine.imatlab_export_fig(exporter, nargout=0)
+            self._displays.clear()
+            # Each notebook needs its own copy of plotly.js.
+            self._plotly_initialized = False
+
+        def run_cell(self, code):
+            """Execute *code*; return its outputs and the execute_reply."""
+            self._outputs = []
+            reply = self.do_execute(code, False, store_history=False)
+            if inspect.isawaitable(reply):  # ipykernel>=6.
+                reply = self._loop.run_until_complete(reply)
+            return self._outputs, reply
+
+    return BatchKernel
+
+
+# The kernel of the current worker process, or the exception raised while
+# starting it.
+_kernel = None
+_kernel_error = None
+
+
+def _init_worker():
+    # Errors are reported by `_run_notebook`, as the pool would otherwise keep
+    # restarting workers.
+    global _kernel, _kernel_error
+    from traitlets.config import Config
+    config = Config()
+    # Not a console front-end, so that figures are exported; also names the
+    # worker's workspace checkpoints.
+    config.IPKernelApp.connection_file = "imatlab-run-{}.json".format(
+        os.getpid())
+    try:
+        _kernel = _make_kernel_class()(config=config)
+    except Exception as exc:
+        _kernel_error = exc
+        return
+    # Exit the engine when the pool is closed.
+    Finalize(_kernel, _kernel.do_shutdown, args=(False,), exitpriority=10)
+
+
+def _run_notebook(task):
+    path, output_path, exporter, allow_errors = task
+    start = time.perf_counter()
+    summary = {"path": str(path), "output": str(output_path),
+               "worker": os.getpid(), "cells": []}
+    try:
+        if _kernel_error is not None:
+            raise _kernel_error
+        notebook = read_notebook(path)
+        _kernel.reset(Path(path).resolve().parent, exporter)
+        status = "ok"
+        execution_count = 0
+        for index, cell in enumerate(notebook["cells"]):
+            if cell["cell_type"] != "code":
+                continue
+            source = cell["source"]
+            if isinstance(source, list):
+                source = "".join(source)
+            execution_count += 1
+            outputs, reply = _kernel.run_cell(source)
+            timings = dict(_kernel._timer.current)
+            cell["outputs"] = outputs
+            cell["execution_count"] = execution_count
+            cell["metadata"]["imatlab_timings"] = timings
+            output = _kernel._output_limiter.current
+            if output["dropped"]:
+                cell["metadata"]["imatlab_output"] = dict(output)
+            summary["cells"].append({"index": index,
+                                     "status": reply["status"],
+                                     "elapsed": timings.get("total")})
+            if reply["status"] != "ok":
+                status = "error"
+                if not allow_errors:
+                    break
+        Path(output_path).write_text(
+            json.dumps(notebook, indent=1, ensure_ascii=False) + "\n",
+            encoding="utf-8")
+    except Exception as exc:
+        status = "failed"
+        summary["error"] = "{}: {}".format(type(exc).__name__, exc)
+    summary["status"] = status
+    summary["elapsed"] = time.perf_counter() - start
+    return summary
+
+
+def _output_paths(paths, output_dir):
+    # Named after the inputs, disambiguated if needed.
+    outputs = []
+    used = set()
+    for path in paths:
+        stem = Path(path).stem
+        name = stem + ".ipynb"
+        i = 1
+        while name in used:
+            i += 1
+            name = "{}-{}.ipynb".format(stem, i)
+        used.add(name)
+        outputs.append(output_dir / name)
+    return outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -mimatlab run",
+        description="Execute MATLAB notebooks or scripts without a "
+                    "front-end.")
+    parser.add_argument(
+        "paths", nargs="+", metavar="path",
+        help="notebooks (.ipynb) or scripts (.m, split into cells at %%%% "
+             "lines)")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="number of worker processes, each with its own engine "
+             "(default: %(default)s)")
+    parser.add_argument(
+        "-o", "--output-dir", type=Path, default=Path("executed"),
+        help="directory where executed notebooks and {} are written "
+             "(default: %(default)s)".format(_SUMMARY_NAME))
+    parser.add_argument(
+        "--exporter", default="print-png",
+        help="figure exporter, as passed to imatlab_export_fig "
+             "(default: %(default)s)")
+    parser.add_argument(
+        "--allow-errors", action="store_true",
+        help="keep executing a notebook after a cell fails")
+    args = parser.parse_args(argv)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [
+        (path, output_path, args.exporter, args.allow_errors)
+        for path, output_path
+        in zip(args.paths, _output_paths(args.paths, args.output_dir))]
+    start = time.perf_counter()
+    summaries = {}
+    # Spawned, so that workers do not inherit the parent's state (and MATLAB
+    # never runs in a forked process).
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(min(args.jobs, len(tasks)), _init_worker)
+    try:
+        for summary in pool.imap_unordered(_run_notebook, tasks):
+            summaries[summary["path"]] = summary
+            print("{status:6} {elapsed:8.2f}s  {path}".format(**summary),
+                  flush=True)
+            if "error" in summary:
+                print("       " + summary["error"], flush=True)
+    finally:
+        pool.close()  # Let workers exit their engines.
+        pool.join()
+    report = {
+        "jobs": args.jobs,
+        "elapsed": time.perf_counter() - start,
+        "notebooks": [summaries[str(path)] for path in args.paths],
+    }
+    (args.output_dir / _SUMMARY_NAME).write_text(
+        json.dumps(report, indent=1) + "\n", encoding="utf-8")
+    if any(summary["status"] != "ok" for summary in report["notebooks"]):
+        sys.exit(1)
@@ -0,0 +1,206 @@
+"""
+A lightweight MATLAB tokenizer, to check whether code is complete without
+calling MATLAB.
+
+Only the common cases are handled (block keywords, brackets, strings and
+transposes, comments, continuation lines); `is_complete` returns None when the
+code falls outside of them, in which case MATLAB should be asked instead.
+"""
+
+import re
+
+
+_OPENERS = {
+    "for", "parfor", "while", "if", "switch", "try", "function", "spmd",
+    "classdef",
+}
+_CLASSDEF_OPENERS = {"methods", "properties", "events", "enumeration"}
+_CONTINUATIONS = {
+    "elseif": {"if"}, "else": {"if"}, "case": {"switch"},
+    "otherwise": {"switch"}, "catch": {"try"},
+}
+_KEYWORDS = _OPENERS | set(_CONTINUATIONS) | {
+    "end", "break", "continue", "return", "global", "persistent",
+}
+# Keywords which must be followed by an expression.
+_NEED_EXPRESSION = {
+    "for", "parfor", "while", "if", "elseif", "switch", "case",
+}
+_BRACKETS = {")": "(", "]": "[", "}": "{"}
+
+_IDENTIFIER = re.compile(r"[a-zA-Z]\w*")
+_NUMBER = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[eEdD][+-]?\d+)?[ij]?")
+_STRINGS = {quote: re.compile(r"{0}(?:[^{0}]|{0}{0})*{0}".format(quote))
+            for quote in "'\""}
+# Possible command syntax (`hold on`, `format long g`, ...).
+_COMMAND = re.compile(r"\s*([a-zA-Z]\w*)[ \t]+(?![\s=(])(.*)")
+
+
+class _Ambiguous(Exception):
+    pass
+
+
+class _Invalid(Exception):
+    pass
+
+
+def _tokenize_line(line, stack, need_expression, opened):
+    """
+    Process *line*, updating *stack* (of open keywords and brackets) and
+    *opened* (the set of all block keywords seen) in place.
+
+    Return whether the line ends with a continuation, and whether an
+    expression is still required after the last keyword.
+    """
+    i = 0
+    n = len(line)
+    # Whether a quote at this point would be a transpose.
+    transpose = False
+    after_space = False
+    after_dot = False
+    while i < n:
+        c = line[i]
+        if c in " \t":
+            after_space = True
+            i += 1
+            continue
+        in_brackets = bool(stack) and stack[-1] in "([{"
+        if line.startswith("...", i):
+            return True, need_expression
+        if c == "%" or (c == "!" and not in_brackets
+                        and not line[:i].strip()):
+            break  # Comment, or shell escape.
+        if need_expression and c in ",;":
+            raise _Invalid
+        if c == "'" and transpose and not (
+                after_space and in_brackets and stack[-1] in "[{"):
+            i += 1
+            transpose = True
+        elif c in "'\"":
+            match = _STRINGS[c].match(line, i)
+            if not match:
+                raise _Invalid  # Strings cannot span multiple lines.
+            i = match.end()
+            transpose = False
+            need_expression = False
+        elif c in "([{":
+            stack.append(c)
+            i += 1
+            transpose = False
+            need_expression = False
+        elif c in ")]}":
+            if not stack or stack[-1] != _BRACKETS[c]:
+                raise _Invalid
+            stack.pop()
+            i += 1
+            transpose = True
+        elif _IDENTIFIER.match(line, i):
+            word = _IDENTIFIER.match(line, i).group()
+            i += len(word)
+            transpose = True
+            if (word in _CLASSDEF_OPENERS and not after_dot
+                    and not in_brackets and stack and stack[-1] == "classdef"):
+                stack.append(word)
+                transpose = False
+            elif after_dot or word not in _KEYWORDS:
+                need_expression = False
+            elif word == "end" and in_brackets:
+                pass  # Indexing.
+            elif need_expression or in_brackets:
+                raise _Invalid
+            elif word == "end":
+                if not stack:
+                    raise _Invalid
+                stack.pop()
+            elif word in _CONTINUATIONS:
+                if not stack or stack[-1] not in _CONTINUATIONS[word]:
+                    raise _Invalid
+                need_expression = word in _NEED_EXPRESSION
+                transpose = False
+            elif word in _OPENERS:
+                stack.append(word)
+                opened.add(word)
+                need_expression = word in _NEED_EXPRESSION
+                transpose = False
+            else:
+                transpose = False
+        elif _NUMBER.match(line, i):
+            i = _NUMBER.match(line, i).end()
+            transpose = True
+            need_expression = False
+        elif c == "." and line.startswith(".'", i):
+            i += 2
+            transpose = True
+        else:
+            i += 1
+            transpose = False
+        after_dot = c == "."
+        after_space = False
+    return False, need_expression
+
+
+def is_complete(code):
+    """
+    Return ``"complete"``, ``"incomplete"``, or ``"invalid"`` for *code*, or
+    None if *code* cannot be reliably checked without MATLAB.
+    """
+    return _scan(code, set())
+
+
+def block_keywords(code):
+    """
+    Return the set of block keywords (``for``, ``if``, ``function``, ...)
+    opening blocks in *code*, which should be complete.
+    """
+    opened = set()
+    _scan(code, opened)
+    return opened
+
+
+def _scan(code, opened):
+    stack = []
+    continued = False
+    need_expression = False
+    in_block_comment = False
+    try:
+        for line in code.split("\n"):
+            stripped = line.strip()
+            if in_block_comment:
+                in_block_comment = stripped != "%}"
+                continue
+            if stripped == "%{" and not continued:
+                in_block_comment = True
+                continue
+            at_statement_start = not continued and not (
+                stack and stack[-1] in "([{")
+            if at_statement_start:
+                if need_expression:
+                    raise _Invalid
+                match = _COMMAND.match(line)
+                if match and match.group(1) not in _KEYWORDS:
+                    # Command syntax: arguments are not tokenized normally.
+                    if (re.search(r"[()\[\]{}'\"]|\.\.\.", match.group(2))
+                            or set(re.findall(r"\w+", match.group(2)))
+                            & _KEYWORDS):
+                        raise _Ambiguous
+                    continue
+            elif stack and stack[-1] == "(" and not continued:
+                raise _Invalid  # Newlines are not allowed in parentheses.
+            continued, need_expression = _tokenize_line(
+                line, stack, need_expression, opened)
+    except _Invalid:
+        return "invalid"
+    except _Ambiguous:
+        return None
+    if in_block_comment:
+        return None
+    if continued:
+        return "incomplete"
+    if need_expression:
+        return "invalid"
+    if any(entry in "([{" for entry in stack):
+        return "incomplete"
+    if all(entry == "function" for entry in stack):
+        # Functions do not need to be closed by `end`.
+        return "complete"
+    return "incomplete"
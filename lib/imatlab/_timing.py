@@ -0,0 +1,57 @@
+"""
+Per-phase timing of cell execution.
+"""
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import time
+
+
+class PhaseTimer:
+    """
+    Time the phases of the current cell, and keep the last *maxlen* samples of
+    each phase for aggregate statistics.
+    """
+
+    def __init__(self, maxlen=10000):
+        self.current = {}
+        self._samples = defaultdict(lambda: deque(maxlen=maxlen))
+
+    def start_cell(self):
+        self.current = {}
+
+    def add(self, phase, elapsed):
+        self.current[phase] = self.current.get(phase, 0) + elapsed
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def end_cell(self):
+        for phase, elapsed in self.current.items():
+            self._samples[phase].append(elapsed)
+
+    def stats(self):
+        """Return a mapping of phases to their count, p50 and p99 (in s)."""
+        stats = {}
+        for phase, samples in self._samples.items():
+            samples = sorted(samples)
+            n = len(samples)
+            stats[phase] = {
+                "count": n,
+                "p50": samples[n // 2],
+                "p99": samples[min(int(n * .99), n - 1)],
+            }
+        return stats
+
+    def format_stats(self):
+        lines = ["{:<10}{:>8}{:>12}{:>12}".format(
+            "phase", "count", "p50 (ms)", "p99 (ms)")]
+        for phase, stats in sorted(self.stats().items()):
+            lines.append("{:<10}{:>8}{:>12.2f}{:>12.2f}".format(
+                phase, stats["count"], 1e3 * stats["p50"], 1e3 * stats["p99"]))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,74 @@
+"""
+Engine health monitoring, and cleanup of dead engines.
+"""
+
+import os
+import signal
+import threading
+
+
+def release_engine(engine, pid=None):
+    """
+    Release a (possibly dead) engine, killing its MATLAB process *pid* (if
+    given) if it cannot be closed normally.
+
+    Dead engines cannot simply be garbage-collected, as `MatlabEngine.__del__`
+    would then try to close them again, which raises an uncatchable exception.
+    """
+    try:
+        engine.exit()
+    except Exception:
+        if pid:
+            try:
+                os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+            except OSError:  # Already gone.
+                pass
+    # Make `__del__` a no-op (`exit` already does so on success).
+    engine.__dict__.pop("_matlab", None)
+
+
+def process_usage(pid):
+    """
+    Return the resident memory (in bytes) and CPU time (in seconds) of process
+    *pid*, or None if they are unavailable (only Linux is supported).
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as file:
+            rss_kb, = [int(line.split()[1]) for line in file
+                       if line.startswith("VmRSS:")]
+        with open("/proc/{}/stat".format(pid)) as file:
+            # The command name (2nd field) may contain spaces.
+            fields = file.read().rsplit(")", 1)[1].split()
+    except (OSError, ValueError):
+        return None
+    utime, stime = int(fields[11]), int(fields[12])
+    return {"rss": 1024 * rss_kb,
+            "cpu_time": (utime + stime) / os.sysconf("SC_CLK_TCK")}
+
+
+class Watchdog:
+    """
+    Call *check* every *interval* seconds from a background thread, skipping
+    the calls for which *lock* (which is held while the engine is in use) is
+    not immediately available.
+    """
+
+    def __init__(self, lock, check, interval):
+        self._lock = lock
+        self._check = check
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            if not self._lock.acquire(blocking=False):
+                continue
+            try:
+                self._check()
+            finally:
+                self._lock.release()
+
+    def stop(self):
+        self._stopped.set()
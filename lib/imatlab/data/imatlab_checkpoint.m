@@ -0,0 +1,130 @@
+function result = imatlab_checkpoint(action, directory)
+    % IMATLAB_CHECKPOINT Checkpoint or restore the base workspace for imatlab.
+    %
+    %   info = IMATLAB_CHECKPOINT('save', directory)
+    %     saves the variables of the base workspace which changed since the
+    %     last checkpoint in directory, and the current directory.  Each
+    %     variable is saved to its own -v7.3 MAT-file (so that it can be
+    %     loaded with matfile); directory/manifest.mat maps variable names to
+    %     these files and to the signatures of the saved values.  As for
+    %     IMATLAB_VARIABLES, signatures are built from the class, size, and
+    %     byte count of each variable and, for variables of at most 1 MiB, a
+    %     checksum of the value (so that changes to larger variables which
+    %     keep these are not saved).  info is a struct with fields 'saved',
+    %     'deleted', 'skipped' (the names of the variables which could not be
+    %     saved), and 'unhashed' (the names of the variables of at most 1 MiB
+    %     whose checksum could not be computed, e.g. without Java).
+    %
+    %   info = IMATLAB_CHECKPOINT('restore', directory)
+    %     loads the variables of the checkpoint in directory into the base
+    %     workspace (except those already defined there), and changes to the
+    %     saved current directory.  info is a struct with fields 'restored'
+    %     and 'failed'.
+    %
+    %   This function is used by the kernel when IMATLAB_CHECKPOINT is set,
+    %   to restore the workspace after an engine crash or a restart.
+
+    manifest_file = fullfile(directory, 'manifest.mat');
+    switch action
+        case 'save'
+            if exist(manifest_file, 'file')
+                manifest = load(manifest_file);
+                manifest = manifest.manifest;
+            else
+                if ~exist(directory, 'dir')
+                    mkdir(directory);
+                end
+                manifest = struct('names', {{}}, 'signatures', {{}}, ...
+                                  'files', {{}}, 'next', 0, 'cwd', '');
+            end
+            vars = evalin('base', 'whos');
+            names = {vars.name};
+            previous = manifest;
+            manifest.names = names;
+            manifest.signatures = cell(size(names));
+            manifest.files = cell(size(names));
+            manifest.cwd = builtin('cd');
+            saved = {};
+            skipped = {};
+            unhashed = {};
+            for i = 1:numel(names)
+                % Only small variables are serialized for checksumming.
+                signature = sprintf('%s-%s-%d', vars(i).class, ...
+                                    mat2str(vars(i).size), vars(i).bytes);
+                if vars(i).bytes <= 2^20
+                    try
+                        checksum = imatlab_checksum( ...
+                            evalin('base', names{i}));
+                    catch
+                        checksum = '';
+                    end
+                    if isempty(checksum)
+                        unhashed{end + 1} = names{i};  %#ok<AGROW>
+                    else
+                        signature = [signature '-' checksum];
+                    end
+                end
+                manifest.signatures{i} = signature;
+                [found, j] = ismember(names{i}, previous.names);
+                if found && strcmp(signature, previous.signatures{j})
+                    manifest.files{i} = previous.files{j};
+                    continue
+                end
+                % New files are only referenced once fully written.
+                file = sprintf('v%d.mat', manifest.next);
+                manifest.next = manifest.next + 1;
+                contents = struct( ...
+                    names{i}, {evalin('base', names{i})});  %#ok<NASGU>
+                try
+                    save(fullfile(directory, file), '-struct', 'contents', ...
+                         '-v7.3');
+                catch
+                    skipped{end + 1} = names{i};  %#ok<AGROW>
+                    continue
+                end
+                manifest.files{i} = file;
+                saved{end + 1} = names{i};  %#ok<AGROW>
+            end
+            keep = ~cellfun(@isempty, manifest.files);
+            manifest.names = manifest.names(keep);
+            manifest.signatures = manifest.signatures(keep);
+            manifest.files = manifest.files(keep);
+            tmp_file = fullfile(directory, 'manifest.tmp.mat');
+            save(tmp_file, 'manifest');
+            movefile(tmp_file, manifest_file, 'f');
+            % Files of deleted, changed, or unsaved variables.
+            stale = setdiff(previous.files, manifest.files);
+            for i = 1:numel(stale)
+                delete(fullfile(directory, stale{i}));
+            end
+            result = struct( ...
+                'saved', {saved}, ...
+                'deleted', {setdiff(previous.names, names)}, ...
+                'skipped', {skipped}, ...
+                'unhashed', {unhashed});
+        case 'restore'
+            manifest = load(manifest_file);
+            manifest = manifest.manifest;
+            restored = {};
+            failed = {};
+            for i = 1:numel(manifest.names)
+                name = manifest.names{i};
+                if evalin('base', sprintf('exist(''%s'', ''var'')', name))
+                    continue
+                end
+                try
+                    contents = matfile(fullfile(directory, manifest.files{i}));
+                    assignin('base', name, contents.(name));
+                    restored{end + 1} = name;  %#ok<AGROW>
+                catch
+                    failed{end + 1} = name;  %#ok<AGROW>
+                end
+            end
+            if exist(manifest.cwd, 'dir')
+                builtin('cd', manifest.cwd);
+            end
+            result = struct('restored', {restored}, 'failed', {failed});
+        otherwise
+            error('imatlab:invalidAction', 'unknown action ''%s''', action);
+    end
+end
@@ -0,0 +1,113 @@
+function result = imatlab_execute_cell(code, export_dir, script)
+    % IMATLAB_EXECUTE_CELL Execute a notebook cell for imatlab.
+    %
+    %   result = IMATLAB_EXECUTE_CELL(code, export_dir, script)
+    %     clears the debugger, evaluates code (or, if script is nonempty, runs
+    %     the script of that name) in the base workspace and, if export_dir
+    %     is nonempty and there are open figures, calls imatlab_export_fig
+    %     from export_dir.  Returns a struct with fields
+    %       status: 'error' if code failed to evaluate, 'ok' otherwise;
+    %       exported: the cell array returned by imatlab_export_fig;
+    %       variables: the names of the variables in the base workspace;
+    %       fields: a struct mapping the names of scalar struct variables to
+    %         their field names;
+    %       path_state: a checksum of the path and the current directory;
+    %       timings: a struct of the durations (in seconds) of the 'dbclear',
+    %         'eval', 'detect' (figure detection), 'export' and 'workspace'
+    %         phases;
+    %       dump_timings: whether the kernel should print aggregate timing
+    %         statistics (if the IMATLAB_TIMINGS environment variable is
+    %         nonempty, or imatlab_timings was called).
+    %
+    %   This function is called by the kernel once per cell, so that each cell
+    %   only requires a single round-trip through the engine.
+
+    result = struct('status', 'ok', 'exported', {{}});
+    timings = struct( ...
+        'dbclear', 0, 'eval', 0, 'detect', 0, 'export', 0, 'workspace', 0);
+
+    % The debugger may have been set e.g. in startup.m (or later), but it
+    % interacts poorly with the engine.
+    t = tic;
+    dbclear('all');
+    timings.dbclear = toc(t);
+
+    t = tic;
+    try
+        if isempty(script)
+            evalin('base', code);
+        else
+            if isempty(builtin('which', script))
+                rehash;  % The script was just written.
+            end
+            if ~run_script(script)
+                result.status = 'error';
+            end
+        end
+    catch me
+        % Errors in the cell are reported by the cell itself; this only
+        % catches e.g. syntax errors.
+        fprintf(2, '%s\n', me.message);
+        result.status = 'error';
+    end
+    timings.eval = toc(t);
+
+    t = tic;
+    do_export = ~isempty(export_dir) ...
+        && ~isempty(builtin('get', 0, 'children')) ...
+        && ~isempty(builtin('which', 'imatlab_export_fig'));
+    timings.detect = toc(t);
+    if do_export
+        t = tic;
+        cwd = builtin('cd', export_dir);
+        cleanup = onCleanup(@() builtin('cd', cwd));
+        result.exported = imatlab_export_fig;
+        clear cleanup  % Back to the current directory, for path_state.
+        timings.export = toc(t);
+    end
+
+    % Used by the kernel for completion.
+    t = tic;
+    vars = evalin('base', 'whos');
+    result.variables = {vars.name};
+    result.fields = struct();
+    is_scalar_struct = strcmp({vars.class}, 'struct')' ...
+        & arrayfun(@(v) prod(v.size) == 1, vars);
+    for var = vars(is_scalar_struct)'
+        result.fields.(var.name) = fieldnames(evalin('base', var.name));
+    end
+    result.path_state = imatlab_checksum({path, builtin('cd')});
+    if isempty(result.path_state)
+        result.path_state = [path, pathsep, builtin('cd')];
+    end
+    timings.workspace = toc(t);
+
+    result.timings = timings;
+    result.dump_timings = ~isempty(getenv('IMATLAB_TIMINGS')) ...
+        || isappdata(0, 'imatlab_dump_timings');
+    if isappdata(0, 'imatlab_dump_timings')
+        rmappdata(0, 'imatlab_dump_timings');
+    end
+end
+
+function ok = run_script(script)
+    % Report errors as the kernel's try/catch wrapper around eval'd code
+    % does, i.e. without mentioning the script.  Returns false if the script
+    % failed to parse, which (like a syntax error in eval'd code) is an error
+    % of the cell itself.
+    ok = true;
+    try
+        evalin('base', script);
+    catch me
+        location = '(<a [^>]*>)?imatlab_cell_\w+(</a>)? \(line \d+\)';
+        report = regexprep(me.getReport, ...
+            {['Error using ', location, '\n'], ...
+             ['\n*Error in ', location, '\n[^\n]*']}, '');
+        if any(strcmp({me.stack.name}, script))
+            fprintf('%s\n', report);
+        else  % Raised before the script started running.
+            fprintf(2, '%s\n', report);
+            ok = false;
+        end
+    end
+end
@@ -1,21 +1,43 @@
-function exported = imatlab_export_fig(exporter)
+function exported = imatlab_export_fig(exporter, varargin)
     % IMATLAB_EXPORT_FIG Set exporter or export figures for imatlab.
     %
     %   IMATLAB_EXPORT_FIG(exporter)
     %     where exporter is one of
-    %       {'', 'fig2plotly', 'print-png', 'print-svg', 'print-jpeg'}
-    %     sets the current exporter.
+    %       {'', 'fig2plotly', 'print-png', 'print-svg', 'print-jpeg',
+    %        'memory-png', 'auto'}
+    %     sets the current exporter.  The 'auto' exporter picks svg (for
+    %     figures with few data points), jpeg (for images and dense
+    %     surfaces), or png (otherwise), and lowers the resolution of
+    %     figures larger than IMATLAB_FIGURE_BUDGET bytes (default: 1 MiB);
+    %     figures beyond a total of IMATLAB_CELL_BUDGET bytes per cell
+    %     (default: 4 MiB), or which still exceed the budget at low
+    %     resolution, are skipped.
+    %
+    %   IMATLAB_EXPORT_FIG(exporter, 'keep', true)
+    %     additionally keeps figures open after they are exported; later,
+    %     only figures that are new or have been modified are exported again
+    %     (including figures which the 'auto' exporter skipped as too large).
     %
     %   exported = IMATLAB_EXPORT_FIG
     %     orders the current figures by number, exports and closes them, and
-    %     returns a cell array of exported filenames.
+    %     returns a cell array of exported filenames.  The 'fig2plotly'
+    %     exporter writes JSON files containing the Plotly figure's 'data'
+    %     and 'layout'.  The 'memory-png' exporter does not write files, but
+    %     returns structs with fields 'width', 'height', and 'data' (a row
+    %     vector of row-major, interleaved RGB values) instead of filenames.
+    %     When figures are kept, each entry is a struct with fields
+    %     'display_id' and 'update' (whether the figure was previously
+    %     exported with that display_id), and either 'file' (the filename)
+    %     or the fields above.
 
-    persistent set_exporter
+    persistent set_exporter keep
     if isempty(set_exporter)
         set_exporter = '';
+        keep = false;
     end
     valid_exporters = { ...
-        '', 'fig2plotly', 'print-png', 'print-svg', 'print-jpeg'};
+        '', 'fig2plotly', 'print-png', 'print-svg', 'print-jpeg', ...
+        'memory-png', 'auto'};
 
     if exist('exporter', 'var')
         if strcmp(exporter, '')
@@ -33,6 +55,15 @@ function exported = imatlab_export_fig(exporter)
                 end
             end
             set_exporter = exporter;
+            keep = false;
+            for k = 1:2:numel(varargin)
+                if strcmpi(varargin{k}, 'keep')
+                    keep = logical(varargin{k + 1});
+                else
+                    error('imatlab:invalidOption', ...
+                          'unknown option ''%s''', varargin{k});
+                end
+            end
         else
             error('imatlab:invalidExporter', ...
                   ['known exporters are ', ...
@@ -46,18 +77,87 @@ function exported = imatlab_export_fig(exporter)
         [~, idx] = sort([children.Number]);
         children = children(idx);
         exported = cell(1, numel(children));
+        if strcmp(set_exporter, 'auto')
+            figure_budget = getenv_number('IMATLAB_FIGURE_BUDGET', 2^20);
+            cell_budget = getenv_number('IMATLAB_CELL_BUDGET', 2^22);
+        end
         for i = 1:numel(children)
             child = children(i);
+            if keep
+                % Skip figures which did not change since they were last
+                % exported (the signature is stored on the figure itself).
+                signature = figure_signature(child);
+                info = getappdata(child, 'imatlab_display');
+                if isempty(info)
+                    [~, display_id] = fileparts(tempname);
+                    info = struct('display_id', ['imatlab-', display_id]);
+                end
+                % Whether the figure was already displayed.
+                update = isfield(info, 'signature');
+                % An empty signature could not be computed.
+                if update && ~isempty(signature) ...
+                        && strcmp(info.signature, signature)
+                    continue
+                end
+            end
             name = tempname('.');
             if strcmp(set_exporter, 'fig2plotly')
-                exported{i} = [name, '.html'];
+                % Only export the figure's data and layout; the kernel loads
+                % plotly.js once per session.
+                exported{i} = [name, '.json'];
                 try
-                    fig2plotly(child, 'filename', name, ...
-                               'offline', true, 'open', false);
+                    p = plotlyfig(child, 'offline', true, 'open', false);
+                    fid = fopen(exported{i}, 'w', 'n', 'UTF-8');
+                    fwrite(fid, jsonencode(struct( ...
+                        'data', {plotly_data_arrays(p.data)}, ...
+                        'layout', p.layout)), 'char');
+                    fclose(fid);
                 catch me
                     warning('fig2plotly failed to export a figure');
                     rethrow(me);
                 end
+            elseif strcmp(set_exporter, 'auto')
+                if cell_budget <= 0
+                    warning('imatlab:budgetExceeded', ...
+                            ['Figure %d not exported as the cell''s ', ...
+                             'IMATLAB_CELL_BUDGET is exhausted.'], ...
+                            child.Number);
+                else
+                    if figure_budget <= cell_budget
+                        budget_name = 'IMATLAB_FIGURE_BUDGET';
+                    else
+                        budget_name = 'IMATLAB_CELL_BUDGET';
+                    end
+                    budget = min(figure_budget, cell_budget);
+                    % Kept figures which did not fit are only retried once
+                    % they changed (or more budget is available).
+                    if keep && isfield(info, 'skipped') ...
+                            && ~isempty(signature) ...
+                            && strcmp(info.skipped.signature, signature) ...
+                            && budget <= info.skipped.budget
+                        continue
+                    end
+                    exported{i} = export_auto( ...
+                        child, name, budget, budget_name);
+                    if isempty(exported{i}) && keep
+                        info.skipped = struct( ...
+                            'signature', signature, 'budget', budget);
+                        setappdata(child, 'imatlab_display', info);
+                    elseif ~isempty(exported{i})
+                        file_info = dir(exported{i});
+                        cell_budget = cell_budget - file_info.bytes;
+                    end
+                end
+            elseif strcmp(set_exporter, 'memory-png')
+                ihc = child.InvertHardcopy;
+                child.InvertHardcopy = 'off';  % Respect user background.
+                % Use screen resolution.
+                rgb = print(child, '-RGBImage', '-r0');
+                child.InvertHardcopy = ihc;
+                % Encoded to PNG by the kernel.
+                exported{i} = struct( ...
+                    'width', size(rgb, 2), 'height', size(rgb, 1), ...
+                    'data', reshape(permute(rgb, [3, 2, 1]), 1, []));
             else
                 ihc = child.InvertHardcopy;
                 child.InvertHardcopy = 'off';  % Respect user background.
@@ -67,7 +167,135 @@ function exported = imatlab_export_fig(exporter)
                 print(child, exported{i}, ['-d', ext], '-r0');
                 child.InvertHardcopy = ihc;
             end
-            close(child);
+            if keep
+                if isempty(exported{i})
+                    continue  % Not exported; retried at the next cell.
+                end
+                % Only recorded once exported.
+                info.signature = signature;
+                if isfield(info, 'skipped')
+                    info = rmfield(info, 'skipped');
+                end
+                setappdata(child, 'imatlab_display', info);
+                if ischar(exported{i})
+                    exported{i} = struct('file', exported{i});
+                end
+                exported{i}.display_id = info.display_id;
+                exported{i}.update = update;
+            else
+                close(child);
+            end
+        end
+        exported = exported(~cellfun(@isempty, exported));
+    end
+end
+
+function signature = figure_signature(fig)
+    % Checksum of the properties that most affect the rendering of the
+    % figure and its descendants.
+    props = { ...
+        'Type', 'Position', 'Visible', 'Color', 'Colormap', ...
+        'XLim', 'YLim', 'ZLim', 'CLim', 'View', ...
+        'XData', 'YData', 'ZData', 'CData', 'Vertices', 'Faces', ...
+        'String', 'LineStyle', 'LineWidth', 'Marker', ...
+        'FaceColor', 'EdgeColor'};
+    objs = findall(fig);
+    values = cell(numel(objs), numel(props));
+    for i = 1:numel(objs)
+        for j = 1:numel(props)
+            if isprop(objs(i), props{j})
+                values{i, j} = get(objs(i), props{j});
+            end
+        end
+    end
+    signature = imatlab_checksum(values);
+end
+
+function data = plotly_data_arrays(data)
+    % jsonencode encodes 1-element arrays as scalars, but plotly requires the
+    % data of traces (e.g. a single point's coordinates) to be arrays.
+    fields = {'x', 'y', 'z', 'text', 'ids', 'customdata', ...
+              'labels', 'values', 'lat', 'lon', 'r', 'theta'};
+    if ~iscell(data)
+        data = num2cell(data);
+    end
+    for i = 1:numel(data)
+        for j = 1:numel(fields)
+            if isfield(data{i}, fields{j})
+                value = data{i}.(fields{j});
+                if numel(value) == 1 && ~iscell(value) && ~ischar(value)
+                    data{i}.(fields{j}) = num2cell(value);
+                end
+            end
         end
     end
 end
+
+function filename = export_auto(fig, name, budget, budget_name)
+    % Export fig in a format chosen from its contents, then downscale it
+    % (or rasterize it) until it fits within budget bytes.  Returns '' if it
+    % does not fit (budget_name, the variable setting budget, is then named
+    % in a warning).
+    n_points = 0;
+    n_pixels = 0;
+    for obj = findall(fig)'
+        switch obj.Type
+            case 'image'
+                n_pixels = n_pixels + numel(obj.CData);
+            case 'surface'
+                n_pixels = n_pixels + numel(obj.ZData);
+            case {'line', 'scatter'}
+                n_points = n_points + numel(obj.XData);
+            case 'patch'
+                n_points = n_points + numel(obj.Vertices);
+        end
+    end
+    if n_pixels > 1e4
+        format = 'jpeg';
+    elseif n_points < 5e3
+        format = 'svg';
+    else
+        format = 'png';
+    end
+
+    ihc = fig.InvertHardcopy;
+    fig.InvertHardcopy = 'off';  % Respect user background.
+    resolution = 0;  % Screen resolution.
+    for attempt = 1:5
+        filename = [name, '.', format];
+        if strcmp(format, 'svg')
+            print(fig, filename, '-dsvg', '-painters');
+        else
+            print(fig, filename, ['-d', format], sprintf('-r%d', resolution));
+        end
+        info = dir(filename);
+        if info.bytes <= budget
+            break
+        end
+        delete(filename);
+        if strcmp(format, 'svg')
+            format = 'png';  % Too many objects; rasterize instead.
+            continue
+        end
+        if resolution == 0
+            resolution = get(0, 'ScreenPixelsPerInch');
+        end
+        % The file size scales roughly with the number of pixels.
+        resolution = floor(.9 * resolution * sqrt(budget / info.bytes));
+        if attempt == 5 || resolution < 10
+            warning('imatlab:budgetExceeded', ...
+                    'Figure %d not exported as it exceeds %s.', ...
+                    fig.Number, budget_name);
+            filename = '';
+            break
+        end
+    end
+    fig.InvertHardcopy = ihc;
+end
+
+function value = getenv_number(name, default)
+    value = str2double(getenv(name));
+    if isnan(value)
+        value = default;
+    end
+end
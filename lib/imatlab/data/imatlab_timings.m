@@ -0,0 +1,12 @@
+function imatlab_timings
+    % IMATLAB_TIMINGS Print imatlab's timing statistics after this cell.
+    %
+    %   IMATLAB_TIMINGS
+    %     requests that the kernel prints, once the current cell finishes,
+    %     the count, median and 99th percentile of the duration of each
+    %     phase of cell execution, over the cells executed so far.  Set the
+    %     IMATLAB_TIMINGS environment variable (e.g. with setenv) to print
+    %     them after each cell instead.
+
+    setappdata(0, 'imatlab_dump_timings', true);
+end
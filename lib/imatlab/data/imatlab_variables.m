@@ -0,0 +1,76 @@
+function result = imatlab_variables(action, varargin)
+    % IMATLAB_VARIABLES Inspect the base workspace for imatlab.
+    %
+    %   info = IMATLAB_VARIABLES('list')
+    %     returns a struct with fields 'names', 'classes', 'sizes', 'bytes',
+    %     'complex', and 'signatures' (cell arrays with one entry per
+    %     variable of the base workspace).  The signature is built from the
+    %     class, size, and byte count of the variable and, for variables of
+    %     at most 1 MiB, a checksum of the value (so that changes to larger
+    %     variables which keep these are not detected).
+    %
+    %   page = IMATLAB_VARIABLES('fetch', name, row0, row1, col0, col1)
+    %     returns the block of rows row0 to row1 and columns col0 to col1
+    %     (1-based, inclusive, clipped to the array size) of the
+    %     variable name, reshaped to two dimensions.  page is a struct with
+    %     fields 'class' and 'size' (of the block), and, for numeric and
+    %     logical arrays, 'real' and 'imag' (row vectors of the values in
+    %     row-major order; 'imag' is empty for real arrays), or, for other
+    %     classes, 'text' (the displayed block).
+    %
+    %   Values are returned as row vectors so that the kernel can transfer
+    %   them as raw buffers, without per-element conversion.
+
+    switch action
+        case 'list'
+            vars = evalin('base', 'whos');
+            signatures = cell(1, numel(vars));
+            for i = 1:numel(vars)
+                signatures{i} = sprintf('%s-%s-%d', vars(i).class, ...
+                                        mat2str(vars(i).size), vars(i).bytes);
+                if vars(i).bytes <= 2^20
+                    try
+                        signatures{i} = [signatures{i} '-' ...
+                            imatlab_checksum(evalin('base', vars(i).name))];
+                    catch  % Only the whos metadata is compared.
+                    end
+                end
+            end
+            result = struct( ...
+                'names', {{vars.name}}, 'classes', {{vars.class}}, ...
+                'sizes', {arrayfun(@(v) v.size, vars', ...
+                                   'UniformOutput', false)}, ...
+                'bytes', {{vars.bytes}}, 'complex', {{vars.complex}}, ...
+                'signatures', {signatures});
+        case 'fetch'
+            [name, row0, row1, col0, col1] = varargin{:};
+            value = evalin('base', name);
+            try
+                value = reshape(value, size(value, 1), []);
+                block = value(row0:min(row1, size(value, 1)), ...
+                              col0:min(col1, size(value, 2)));
+            catch
+                block = value;  % Not indexable as an array.
+            end
+            result = struct('class', class(block), 'size', size(block));
+            if isnumeric(block) || islogical(block)
+                if issparse(block)
+                    block = full(block);
+                end
+                if islogical(block)
+                    block = uint8(block);
+                end
+                block = block.';
+                result.real = reshape(real(block), 1, []);
+                if isreal(block)
+                    result.imag = [];
+                else
+                    result.imag = reshape(imag(block), 1, []);
+                end
+            else
+                result.text = evalc('disp(block)');
+            end
+        otherwise
+            error('imatlab:invalidAction', 'unknown action ''%s''', action);
+    end
+end
@@ -0,0 +1,41 @@
+function imatlab_workspace(action, file)
+    % IMATLAB_WORKSPACE Save, restore, or clear the base workspace for imatlab.
+    %
+    %   IMATLAB_WORKSPACE('save', file)
+    %     saves the variables of the base workspace and the current directory
+    %     to the MAT-file file, then clears the workspace.
+    %
+    %   IMATLAB_WORKSPACE('load', file)
+    %     restores the variables and the current directory saved to file, then
+    %     deletes file.
+    %
+    %   IMATLAB_WORKSPACE('clear')
+    %     clears all variables (including globals) and closes all figures.
+    %
+    %   This function is used by the engine broker when an engine is leased
+    %   to another kernel, and by the batch runner between notebooks.
+
+    switch action
+        case 'save'
+            imatlab_cwd__ = builtin('cd');  %#ok<NASGU>
+            save(file, 'imatlab_cwd__', '-v7.3');
+            if ~isempty(evalin('base', 'who'))
+                evalin('base', sprintf('save(''%s'', ''-append'')', ...
+                                       strrep(file, '''', '''''')));
+            end
+            imatlab_workspace('clear');
+        case 'load'
+            saved = load(file, 'imatlab_cwd__');
+            evalin('base', sprintf( ...
+                'load(''%s'', ''-regexp'', ''^(?!imatlab_cwd__$)'')', ...
+                strrep(file, '''', '''''')));
+            builtin('cd', saved.imatlab_cwd__);
+            delete(file);
+        case 'clear'
+            evalin('base', 'clear(''variables'')');
+            clear('global');
+            close('all', 'force');
+        otherwise
+            error('imatlab:invalidAction', 'unknown action ''%s''', action);
+    end
+end
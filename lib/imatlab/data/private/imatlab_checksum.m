@@ -0,0 +1,18 @@
+function checksum = imatlab_checksum(value)
+    % IMATLAB_CHECKSUM MD5 digest of a MATLAB value.
+    %
+    %   checksum = IMATLAB_CHECKSUM(value)
+    %     returns the MD5 digest of the serialized value, as a hexadecimal
+    %     char array, or '' if it cannot be computed (e.g. without Java), in
+    %     which case callers must assume that value changed.
+
+    checksum = '';
+    if ~usejava('jvm')
+        return
+    end
+    digest = java.security.MessageDigest.getInstance('MD5');
+    % The byte stream is uint8, i.e. the size of value, and is passed to Java
+    % as a byte[].
+    digest.update(getByteStreamFromArray(value));
+    checksum = sprintf('%02x', typecast(digest.digest(), 'uint8'));
+end
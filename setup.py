@@ -16,7 +16,7 @@ setup(
     ],
     packages=find_packages("lib"),
     package_dir={"": "lib"},
-    package_data={"imatlab": ["data/imatlab_export_fig.m"]},
+    package_data={"imatlab": ["data/*.m", "data/private/*.m"]},
     python_requires=">=3.5",
     setup_requires=["setuptools_scm"],
     use_scm_version=lambda: {
@@ -0,0 +1,137 @@
+import os
+from multiprocessing.connection import Listener
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# The broker is tested against the fake engine used by the benchmarks.
+sys.path.insert(
+    0, str(Path(__file__).resolve().with_name("benchmarks") / "fake_engine"))
+
+import matlab.engine  # noqa: E402
+
+from imatlab import _broker  # noqa: E402
+
+
+class TestBroker(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        os.environ["IMATLAB_CACHE_DIR"] = self._tmpdir.name
+        self.addCleanup(os.environ.pop, "IMATLAB_CACHE_DIR")
+
+    def start_broker(self, size, **kwargs):
+        broker = _broker.Broker(size, **kwargs)
+        address = (str(Path(self._tmpdir.name, "broker.sock"))
+                   if os.name == "posix" else None)
+        listener = Listener(address, authkey=_broker._get_authkey(True))
+        thread = threading.Thread(target=broker.serve, args=(listener,))
+        thread.start()
+
+        def close():
+            broker.close()
+            listener.close()
+            thread.join()
+
+        self.addCleanup(close)
+        return listener.address
+
+    def connect(self, address):
+        client = _broker.BrokerClient(address)
+        self.addCleanup(client.close)
+        return client
+
+    def test_sticky_lease(self):
+        address = self.start_broker(2)
+        a, b = self.connect(address), self.connect(address)
+        with a.lease() as name_a1:
+            with a.lease() as name_a2:  # Reentrant.
+                self.assertEqual(name_a1, name_a2)
+            with b.lease() as name_b:
+                self.assertNotEqual(name_a1, name_b)
+        with a.lease() as name_a3:
+            self.assertEqual(name_a1, name_a3)
+
+    def test_workspace_isolation(self):
+        address = self.start_broker(1)
+        a, b = self.connect(address), self.connect(address)
+        with a.lease() as name:
+            matlab.engine.connect_matlab(name).workspace["x"] = 1
+        with b.lease() as name:
+            engine = matlab.engine.connect_matlab(name)
+            self.assertEqual(engine.workspace, {})
+            engine.workspace["y"] = 2
+        with a.lease() as name:
+            self.assertEqual(
+                matlab.engine.connect_matlab(name).workspace, {"x": 1})
+        b.reset()
+        with b.lease() as name:
+            self.assertEqual(matlab.engine.connect_matlab(name).workspace, {})
+
+    def test_wait_for_busy_engine(self):
+        address = self.start_broker(1)
+        a, b = self.connect(address), self.connect(address)
+        acquired = threading.Event()
+
+        def lease_b():
+            with b.lease():
+                acquired.set()
+
+        with a.lease():
+            thread = threading.Thread(target=lease_b)
+            thread.start()
+            time.sleep(.1)
+            self.assertFalse(acquired.is_set())
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_disconnect(self):
+        address = self.start_broker(1)
+        a, b = self.connect(address), self.connect(address)
+        with a.lease() as name:
+            matlab.engine.connect_matlab(name).workspace["x"] = 1
+        a.close()
+        time.sleep(.1)
+        with b.lease() as name:
+            self.assertEqual(matlab.engine.connect_matlab(name).workspace, {})
+
+    def test_failed_save(self):
+        address = self.start_broker(1)
+        a, b = self.connect(address), self.connect(address)
+        with a.lease() as name:
+            # Cannot be saved by the fake engine.
+            matlab.engine.connect_matlab(name).workspace["x"] = object()
+        with b.lease() as name:
+            self.assertEqual(matlab.engine.connect_matlab(name).workspace, {})
+        self.assertFalse(a.workspace_lost)
+        with a.lease() as name:
+            self.assertEqual(matlab.engine.connect_matlab(name).workspace, {})
+        self.assertTrue(a.workspace_lost)
+        self.assertFalse(b.workspace_lost)
+
+    def test_idle_timeout(self):
+        address = self.start_broker(1, idle_timeout=.05)
+        a = self.connect(address)
+        with a.lease() as name:
+            engine = matlab.engine.connect_matlab(name)
+            engine.workspace["x"] = 1
+        time.sleep(.2)
+        self.assertEqual(engine.workspace, {})  # Saved and cleared.
+        with a.lease() as name:
+            self.assertEqual(
+                matlab.engine.connect_matlab(name).workspace, {"x": 1})
+
+    def test_lazy_import(self):
+        subprocess.run(
+            [sys.executable, "-c",
+             "import sys, imatlab._broker; "
+             "assert 'matlab' not in sys.modules"],
+            check=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
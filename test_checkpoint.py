@@ -0,0 +1,63 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+
+# The kernel runs against the fake engine used by the benchmarks.
+sys.path.insert(
+    0, str(Path(__file__).resolve().with_name("benchmarks") / "fake_engine"))
+
+from fake_kernel import get_env  # noqa: E402
+
+
+# Run in a subprocess, as the kernel captures the process' stdout and stderr;
+# results are written as JSON to the file given as argument.
+_SCRIPT = textwrap.dedent("""\
+    import json, sys
+    from fake_kernel import make_kernel, run
+
+    kernel = make_kernel()
+    kernel._engine.workspace["a"] = 1
+    run(kernel.do_execute("a = 1", False))
+    run(kernel.do_execute("b = 2", False))  # Waits for the checkpoint.
+    checkpoint_dir = kernel._checkpoint_dir
+    kernel._replace_engine()
+    replaced = kernel._engine.workspace.copy()
+    run(kernel.do_execute("c = 3", False))
+    restored = kernel._engine.workspace.copy()
+    kernel.do_shutdown(False)
+    streams = [content["text"] for msg_type, content in kernel.sent
+               if msg_type == "stream"]
+    with open(sys.argv[1], "w") as file:
+        json.dump({"replaced": replaced, "restored": restored,
+                   "streams": streams,
+                   "deleted": not checkpoint_dir.exists()}, file)
+""")
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_restore_after_replacement(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result_path = Path(tmpdir, "result.json")
+            env = {**get_env(tmpdir),
+                   "IMATLAB_CHECKPOINT": "1",
+                   "IMATLAB_WATCHDOG_INTERVAL": "0"}
+            subprocess.run(
+                [sys.executable, "-c", _SCRIPT, str(result_path)],
+                env=env, check=True, timeout=60)
+            result = json.loads(result_path.read_text())
+        self.assertEqual(result["replaced"], {})
+        self.assertEqual(result["restored"], {"a": 1})
+        self.assertIn(
+            "Restored 1 variable(s) from the workspace checkpoint.\n",
+            result["streams"])
+        self.assertTrue(result["deleted"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+from pathlib import Path
+import tempfile
+import time
+import unittest
+
+from imatlab import _completion
+
+
+class TestCompletionIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.dir = Path(self._tmpdir.name)
+
+    def wait_for_scan(self, index):
+        for _ in range(100):
+            if index._functions is not None:
+                return
+            time.sleep(.01)
+        self.fail("The path was not scanned")
+
+    def test_complete(self):
+        (self.dir / "foo.m").touch()
+        (self.dir / "@fooclass").mkdir()
+        index = _completion.CompletionIndex()
+        index.update_workspace(["fob"], {"s": ["field", "other"]})
+        index.update_path("state", lambda: [str(self.dir)])
+        self.wait_for_scan(index)
+        self.assertEqual(index.complete("x = fo"),
+                         (4, ["fob", "foo", "fooclass", "for"]))
+        self.assertEqual(index.complete("x = s.f"), (6, ["field"]))
+        self.assertIsNone(index.complete("ls fo"))  # Command syntax.
+        self.assertIsNone(index.complete("x = 'fo"))  # Within a string.
+
+    def test_new_file(self):
+        index = _completion.CompletionIndex()
+        index.update_path("state", lambda: [str(self.dir)])
+        self.wait_for_scan(index)
+        self.assertIsNone(index.complete("x = newfunc"))
+        (self.dir / "newfunc.m").touch()
+        os.utime(str(self.dir), (0, 0))  # Regardless of mtime resolution.
+        index._mtimes_checked = 0  # Don't wait for the next check.
+        index.complete("x = newfunc")  # Left to MATLAB while rescanning.
+        self.wait_for_scan(index)
+        self.assertEqual(index.complete("x = newfunc"), (4, ["newfunc"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
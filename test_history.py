@@ -0,0 +1,182 @@
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as ET
+
+# The kernel module is imported with the fake engine used by the benchmarks.
+_FAKE_ENGINE_DIR = str(
+    Path(__file__).resolve().with_name("benchmarks") / "fake_engine")
+
+MatlabHistory = None
+
+
+def setUpModule():
+    global MatlabHistory
+    # Also for the import order probe, which runs in a subprocess and whose
+    # result must not be cached in the user's cache directory.
+    tmpdir = tempfile.TemporaryDirectory()
+    env_patch = mock.patch.dict(os.environ, {
+        "PYTHONPATH": os.pathsep.join(
+            [_FAKE_ENGINE_DIR,
+             *filter(None, [os.environ.get("PYTHONPATH")])]),
+        "IMATLAB_CACHE_DIR": tmpdir.name})
+    path_patch = mock.patch.object(sys, "path", [_FAKE_ENGINE_DIR, *sys.path])
+    with tmpdir, env_patch, path_patch:
+        from imatlab._kernel import MatlabHistory
+
+
+_XML = ('<?xml version="1.0" encoding="UTF-8" standalone="no" ?><history>\n'
+        '<session><command time_stamp="100">%-- old --%</command>\n'
+        '<command>a = 1</command>\n'
+        '<command>b = 2</command>\n'
+        '</session>\n'
+        '</history>')
+
+
+class TestHistoryWriter(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.prefdir = Path(self._tmpdir.name)
+        (self.prefdir / "History.xml").write_text(_XML)
+
+    def make_history(self):
+        history = MatlabHistory(self.prefdir)
+        history._flush_delay = 60  # Only flushed explicitly.
+        self.addCleanup(history.flush)
+        return history
+
+    def sessions(self):
+        root = ET.parse(str(self.prefdir / "History.xml")).getroot()
+        return [[command.text for command in session]
+                for session in root.iter("session")]
+
+    def test_repeated_flushes(self):
+        history = self.make_history()
+        history.append("x = 1", .1, True)
+        history.flush()
+        history.append("y = 2", .1, False)
+        history.append("z = 3", .1, True)
+        history.flush()
+        history.flush()  # Nothing pending.
+        sessions = self.sessions()
+        self.assertEqual(len(sessions), 2)
+        self.assertEqual(sessions[0], ["%-- old --%", "a = 1", "b = 2"])
+        self.assertEqual(sessions[1][1:], ["x = 1", "y = 2", "z = 3"])
+        self.assertRegex(sessions[1][0], r"\A%-- .* --%\Z")
+        root = ET.parse(str(self.prefdir / "History.xml")).getroot()
+        self.assertEqual(
+            [command.get("error") for command in root[1]],
+            [None, None, "true", None])
+        self.assertEqual((self.prefdir / "history.m").read_text(),
+                         "x = 1\ny = 2\nz = 3\n")
+
+    def test_external_modification(self):
+        history = self.make_history()
+        history.append("x = 1", .1, True)
+        history.flush()
+        # E.g., the MATLAB GUI appending its own session.
+        path = self.prefdir / "History.xml"
+        path.write_text(path.read_text().replace(
+            "</history>",
+            "<session><command>gui = 1</command>\n</session>\n</history>"))
+        history.append("y = 2", .1, True)
+        history.flush()
+        sessions = self.sessions()
+        self.assertEqual(len(sessions), 4)
+        self.assertEqual(sessions[1][1:], ["x = 1"])
+        self.assertEqual(sessions[2], ["gui = 1"])
+        self.assertEqual(sessions[3][1:], ["y = 2"])
+
+    def test_missing_closing_tag(self):
+        path = self.prefdir / "History.xml"
+        contents = _XML.replace("</history>", "")
+        path.write_text(contents)
+        history = self.make_history()
+        history.append("x = 1", .1, True)
+        history.flush()
+        self.assertEqual(path.read_text(), contents)  # Left alone.
+        self.assertEqual((self.prefdir / "history.m").read_text(), "x = 1\n")
+
+    def test_no_xml(self):
+        (self.prefdir / "History.xml").unlink()
+        history = self.make_history()
+        history.append("x = 1", .1, True)
+        history.flush()
+        self.assertFalse((self.prefdir / "History.xml").exists())
+        self.assertEqual((self.prefdir / "history.m").read_text(), "x = 1\n")
+
+
+class TestHistoryReader(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.prefdir = Path(self._tmpdir.name)
+        (self.prefdir / "History.xml").write_text(_XML.replace(
+            "</history>",
+            '<session><command time_stamp="200">%-- older --%</command>\n'
+            "<command>c = 3</command>\n"
+            "<command>a = 1</command>\n"
+            "</session>\n</history>"))
+
+    def make_history(self):
+        history = MatlabHistory(self.prefdir)
+        history._flush_delay = 60  # Only flushed explicitly.
+        self.addCleanup(history.flush)
+        return history
+
+    def test_sessions(self):
+        history = self.make_history()
+        history.append("x = 1", .1, True)
+        header = history.get_range(0, 1, 2)[0][2]
+        self.assertEqual(history.session_number, 3)
+        self.assertEqual(
+            history.get_range(1),
+            [(1, 1, "%-- old --%"), (1, 2, "a = 1"), (1, 3, "b = 2")])
+        self.assertEqual(history.get_range(1, 2, 3), [(1, 2, "a = 1")])
+        self.assertEqual(history.get_range(-1), history.get_range(2))
+        self.assertEqual(
+            history.get_range(-1),
+            [(2, 1, "%-- older --%"), (2, 2, "c = 3"), (2, 3, "a = 1")])
+        self.assertEqual(history.get_range(0),
+                         [(3, 1, header), (3, 2, "x = 1")])
+        self.assertEqual(history.get_range(3, 2), [(3, 2, "x = 1")])
+        self.assertEqual(history.get_range(-3), [])
+        self.assertEqual(history.get_range(4), [])
+
+    def test_tail_and_search(self):
+        history = self.make_history()
+        history.append("x = 1", .1, True)
+        self.assertEqual(history.get_tail(2)[-1], (3, 2, "x = 1"))
+        self.assertEqual(len(history.get_tail()), 8)
+        self.assertEqual(
+            history.search("*= 1"),
+            [(1, 2, "a = 1"), (2, 3, "a = 1"), (3, 2, "x = 1")])
+        self.assertEqual(history.search("*= 1", n=2),
+                         [(2, 3, "a = 1"), (3, 2, "x = 1")])
+        # The last occurrence is kept.
+        self.assertEqual(history.search("a*", unique=True),
+                         [(2, 3, "a = 1")])
+
+    def test_reload(self):
+        first = self.make_history()
+        first.append("x = 1", .1, True)
+        first.flush()
+        time.sleep(.01)  # Session time stamps are in milliseconds.
+        second = self.make_history()
+        second.append("y = 2", .1, True)
+        second.flush()
+        self.assertEqual(second.session_number, 4)
+        self.assertEqual(second.get_range(-1)[1:], [(3, 2, "x = 1")])
+        self.assertEqual(second.get_range(0)[1:], [(4, 2, "y = 2")])
+        # Sessions started after ours are not loaded.
+        self.assertEqual(first.session_number, 3)
+        self.assertEqual(first.get_tail(1), [(3, 2, "x = 1")])
+
+
+if __name__ == "__main__":
+    unittest.main()
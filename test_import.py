@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+# The kernel module is imported with the fake engine used by the benchmarks.
+_FAKE_ENGINE_DIR = str(
+    Path(__file__).resolve().with_name("benchmarks") / "fake_engine")
+
+
+def import_times(module):
+    """
+    Return a mapping of the modules imported by importing *module* to their
+    cumulative import time (in seconds), using ``python -X importtime``.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = {**os.environ,
+               "PYTHONPATH": os.pathsep.join(
+                   [_FAKE_ENGINE_DIR,
+                    *filter(None, [os.environ.get("PYTHONPATH")])]),
+               "IMATLAB_CACHE_DIR": tmpdir}
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + module],
+            env=env, stderr=subprocess.PIPE, universal_newlines=True,
+            check=True).stderr
+    return {match.group(2): int(match.group(1)) / 1e6
+            for match in re.finditer(
+                r"(?m)^import time:\s*\d+ \|\s*(\d+) \| *(\S+)$", stderr)}
+
+
+class TestImport(unittest.TestCase):
+    def test_lazy_imports(self):
+        times = import_times("imatlab._kernel")
+        self.assertIn("imatlab._kernel", times)
+        # Only needed for plotly output, or with a broker.
+        for module in ["plotly", "unittest.mock", "imatlab._broker"]:
+            self.assertNotIn(module, times)
+
+    def test_unwritable_cache_dir(self):
+        # The import order probe then runs uncached.
+        with tempfile.NamedTemporaryFile() as file:
+            env = {**os.environ,
+                   "PYTHONPATH": os.pathsep.join(
+                       [_FAKE_ENGINE_DIR,
+                        *filter(None, [os.environ.get("PYTHONPATH")])]),
+                   "IMATLAB_CACHE_DIR": os.path.join(file.name, "cache")}
+            subprocess.run(
+                [sys.executable, "-c", "import imatlab._kernel"],
+                env=env, check=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+from pathlib import Path
+import tempfile
+import unittest
+
+from imatlab._output import OutputLimiter
+
+
+class TestOutputLimiter(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+
+    def test_unlimited(self):
+        limiter = OutputLimiter(0, self._tmpdir.name)
+        self.assertEqual(limiter.filter("x" * 100), "x" * 100)
+        self.assertEqual(limiter.current, {"bytes": 100, "dropped": 0})
+
+    def test_truncate_and_spill(self):
+        limiter = OutputLimiter(10, self._tmpdir.name)
+        self.assertEqual(limiter.filter("abcdef"), "abcdef")
+        sent = limiter.filter("ghijkl")
+        self.assertTrue(sent.startswith("ghij\n[Output truncated"))
+        self.assertEqual(limiter.filter("mn"), "")
+        self.assertEqual(limiter.current["bytes"], 14)
+        self.assertEqual(limiter.current["dropped"], 4)
+        self.assertIn(limiter.current["spill"], sent)
+        self.assertEqual(Path(limiter.current["spill"]).read_text(), "klmn")
+        limiter.start_cell()
+        self.assertEqual(limiter.filter("abc"), "abc")
+        self.assertEqual(limiter.current, {"bytes": 3, "dropped": 0})
+
+    def test_multibyte(self):
+        limiter = OutputLimiter(4, self._tmpdir.name)
+        sent = limiter.filter("aéé")  # 5 bytes.
+        self.assertTrue(sent.startswith("aé\n"))
+        self.assertEqual(
+            Path(limiter.current["spill"]).read_text(encoding="utf-8"),
+            "é")
+
+    def test_no_spill(self):
+        with tempfile.NamedTemporaryFile() as file:
+            # No spill directory, or one that cannot be created.
+            for spill_dir in [None, Path(file.name, "output")]:
+                limiter = OutputLimiter(4, spill_dir)
+                sent = limiter.filter("abcdef")
+                self.assertTrue(sent.startswith("abcd\n[Output truncated"))
+                self.assertIn("output is dropped", sent)
+                self.assertEqual(limiter.filter("gh"), "")
+                self.assertEqual(limiter.current,
+                                 {"bytes": 8, "dropped": 4})
+
+
+if __name__ == "__main__":
+    unittest.main()
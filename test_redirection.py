@@ -0,0 +1,85 @@
+import os
+import socket
+import time
+import unittest
+
+from imatlab._redirection import _Pump, redirect
+
+
+class TestPump(unittest.TestCase):
+    def make_pump(self, max_size=2 ** 16, max_delay=60):
+        self.calls = []
+        self._writer, reader = socket.socketpair()
+        self.addCleanup(self._writer.close)
+        reader.setblocking(False)
+        return _Pump(reader, self.calls.append, "utf-8", max_size, max_delay)
+
+    def wait_for_calls(self, n):
+        for _ in range(100):
+            if len(self.calls) >= n:
+                return
+            time.sleep(.01)
+        self.fail("Callback not called")
+
+    def test_split_multibyte(self):
+        pump = self.make_pump()
+        data = "aé€".encode("utf-8")
+        for i in range(len(data)):
+            self._writer.sendall(data[i:i + 1])
+            pump.flush()
+        pump.close()
+        self.assertEqual("".join(self.calls), "aé€")
+
+    def test_coalesce(self):
+        pump = self.make_pump()
+        for _ in range(100):
+            self._writer.sendall(b"x")
+        pump.flush()
+        self.assertEqual(self.calls, ["x" * 100])
+        pump.close()
+
+    def test_max_size(self):
+        pump = self.make_pump(max_size=4)
+        self._writer.sendall(b"abcd")
+        self.wait_for_calls(1)
+        self.assertEqual(self.calls, ["abcd"])
+        pump.close()
+
+    def test_max_delay(self):
+        pump = self.make_pump(max_delay=.01)
+        self._writer.sendall(b"abc")
+        self.wait_for_calls(1)
+        self.assertEqual(self.calls, ["abc"])
+        pump.close()
+
+    def test_flush_and_close(self):
+        pump = self.make_pump()
+        self._writer.sendall(b"a")
+        pump.flush()
+        self.assertEqual(self.calls, ["a"])
+        pump.flush()  # Nothing pending.
+        self.assertEqual(self.calls, ["a"])
+        # Pending data, including an incomplete character, is forwarded on
+        # close.
+        self._writer.sendall(b"b\xc3")
+        pump.close()
+        self.assertEqual(self.calls, ["a", "b\ufffd"])
+
+
+class TestRedirect(unittest.TestCase):
+    def test_redirect(self):
+        calls = []
+        fd = os.open(os.devnull, os.O_WRONLY)
+        self.addCleanup(os.close, fd)
+        with redirect(fd, calls.append, "utf-8") as pump:
+            os.write(fd, b"a")
+            pump.flush()
+            self.assertEqual(calls, ["a"])
+            os.write(fd, b"b")
+        self.assertEqual(calls, ["a", "b"])
+        os.write(fd, b"c")  # No longer redirected.
+        self.assertEqual(calls, ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
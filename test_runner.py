@@ -0,0 +1,75 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from imatlab._runner import split_script
+
+
+# The runner is tested against the fake engine used by the benchmarks.
+_FAKE_ENGINE_DIR = str(
+    Path(__file__).resolve().with_name("benchmarks") / "fake_engine")
+
+
+class TestSplitScript(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(
+            split_script(
+                "x = 1\n%% Plot\nplot(x)\n\n  %%\ny\n%%%not a cell\n"),
+            ["x = 1", "%% Plot\nplot(x)", "  %%\ny\n%%%not a cell"])
+
+    def test_leading_marker(self):
+        self.assertEqual(split_script("%% A\na\n%% B\nb"),
+                         ["%% A\na", "%% B\nb"])
+
+
+class TestRun(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            (tmpdir / "a.m").write_text("x = 1\n%% Plot\nplot(x)\n")
+            (tmpdir / "b.ipynb").write_text(json.dumps({
+                "cells": [
+                    {"cell_type": "markdown", "metadata": {},
+                     "source": ["Text"]},
+                    {"cell_type": "code", "execution_count": None,
+                     "metadata": {}, "outputs": [], "source": ["y = 2"]}],
+                "metadata": {}, "nbformat": 4, "nbformat_minor": 2}))
+            env = {**os.environ,
+                   "PYTHONPATH": os.pathsep.join(
+                       [_FAKE_ENGINE_DIR,
+                        *filter(None, [os.environ.get("PYTHONPATH")])]),
+                   "IMATLAB_CACHE_DIR": str(tmpdir / "cache"),
+                   "FAKE_MATLAB_OUTPUT": "3",
+                   "FAKE_MATLAB_FIGURES": "1",
+                   "FAKE_MATLAB_FIGURE_SIZE": "8"}
+            subprocess.run(
+                [sys.executable, "-mimatlab", "run", "-j2",
+                 "-o", str(tmpdir / "out"), "a.m", "b.ipynb"],
+                cwd=str(tmpdir), env=env, stdout=subprocess.DEVNULL,
+                check=True, timeout=60)
+            summary = json.loads((tmpdir / "out/summary.json").read_text())
+            self.assertEqual(
+                [(notebook["path"], notebook["status"], len(notebook["cells"]))
+                 for notebook in summary["notebooks"]],
+                [("a.m", "ok", 2), ("b.ipynb", "ok", 1)])
+            notebook = json.loads((tmpdir / "out/a.ipynb").read_text())
+            cell = notebook["cells"][1]
+            self.assertEqual(cell["source"], "%% Plot\nplot(x)")
+            self.assertEqual(cell["execution_count"], 2)
+            self.assertEqual(
+                [output["output_type"] for output in cell["outputs"]],
+                ["stream", "display_data"])
+            self.assertEqual(cell["outputs"][0]["text"], "xxx")
+            self.assertIn("image/png", cell["outputs"][1]["data"])
+            self.assertIn("total", cell["metadata"]["imatlab_timings"])
+            notebook = json.loads((tmpdir / "out/b.ipynb").read_text())
+            self.assertEqual(notebook["cells"][0]["cell_type"], "markdown")
+            self.assertEqual(notebook["cells"][1]["execution_count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+
+from imatlab._syntax import block_keywords, is_complete
+
+
+# (code, expected status); None means that MATLAB needs to be asked.
+CORPUS = [
+    # Samples from test_imatlab.py.
+    ("1+1", "complete"),
+    ("for i=1:3\ni\nend", "complete"),
+    ("function test_complete", "complete"),
+    ("function test_complete, end", "complete"),
+    ("classdef test_complete, end", "complete"),
+    ("for i=1:3", "incomplete"),
+    ("classdef test_complete", "incomplete"),
+    ("for end", "invalid"),
+    # Simple statements.
+    ("", "complete"),
+    ("x = 1;", "complete"),
+    ("x = [1, 2; 3, 4]", "complete"),
+    ("x = [1, 2\n3, 4]", "complete"),
+    ("x = {1, 'a'\n2, 'b'}", "complete"),
+    ("x(end) = x(end - 1);", "complete"),
+    ("y = x{end}(end)", "complete"),
+    ("s.end = 1", "complete"),
+    ("s.for.if = 2", "complete"),
+    ("z = 1e-3 + .5i + 2.", "complete"),
+    # Brackets.
+    ("x = [1, 2", "incomplete"),
+    ("x = {1, 2", "incomplete"),
+    ("f(1, 2", "incomplete"),
+    ("f(1,\n2)", "invalid"),
+    ("f(1, ...\n2)", "complete"),
+    ("x = [1, 2)", "invalid"),
+    ("x = 1)", "invalid"),
+    ("x = ]", "invalid"),
+    # Strings and transposes.
+    ("x = 'it''s'", "complete"),
+    ('x = "say ""hi"""', "complete"),
+    ("x = 'a % not a comment'", "complete"),
+    ("x = 'a ... not a continuation'", "complete"),
+    ("x = 'unterminated", "invalid"),
+    ('x = "unterminated', "invalid"),
+    ("y = x'", "complete"),
+    ("y = x''", "complete"),
+    ("y = x.'", "complete"),
+    ("y = (x + 1)'", "complete"),
+    ("y = [x' x']", "complete"),
+    ("y = [x 'a']", "complete"),
+    ("y = {'a', 'b'}'", "complete"),
+    # Comments.
+    ("x = 1  % comment", "complete"),
+    ("% for", "complete"),
+    ("x = [1, 2  % comment\n3]", "complete"),
+    ("%{\nfor\n%}\nx = 1", "complete"),
+    ("%{\nfor", None),
+    # Continuations.
+    ("x = 1 + ...", "incomplete"),
+    ("x = 1 + ... comment\n2", "complete"),
+    ("x = [1, ...\n2]", "complete"),
+    # Blocks.
+    ("if x\n1\nelseif y\n2\nelse\n3\nend", "complete"),
+    ("if x, 1, end", "complete"),
+    ("if x\n1\nelse", "incomplete"),
+    ("if x\nfor i = 1:3\nend", "incomplete"),
+    ("while true\nbreak\nend", "complete"),
+    ("switch x\ncase 1\ny\notherwise\nz\nend", "complete"),
+    ("switch x\ncase 1", "incomplete"),
+    ("try\nx\ncatch me\ny\nend", "complete"),
+    ("try\nx", "incomplete"),
+    ("parfor i = 1:3\nend", "complete"),
+    ("spmd\nx\nend", "complete"),
+    ("end", "invalid"),
+    ("for i = 1:3\nend\nend", "invalid"),
+    ("else", "invalid"),
+    ("case 1", "invalid"),
+    ("if x\ncatch\nend", "invalid"),
+    ("if", "invalid"),
+    ("if\nx\nend", "invalid"),
+    ("if x, else, end", "complete"),
+    ("while, end", "invalid"),
+    ("x = [1, end]", "complete"),
+    ("x = [if]", "invalid"),
+    # Functions and classes.
+    ("function y = f(x)\ny = x;", "complete"),
+    ("function y = f(x)\ny = x;\nend", "complete"),
+    ("function f\nfor i = 1:3", "incomplete"),
+    ("function f\nfunction g", "complete"),
+    ("classdef C\nproperties\nx\nend\nmethods\nfunction f(o)\nend\nend\nend",
+     "complete"),
+    ("classdef C\nproperties (Access = private)\nx", "incomplete"),
+    ("methods(obj)", "complete"),
+    ("x = properties(obj);", "complete"),
+    # Command syntax.
+    ("hold on", "complete"),
+    ("format long g", "complete"),
+    ("hold on\nfor i = 1:3", "incomplete"),
+    ("disp 'hello'", None),
+    ("disp end", None),
+    ("cd ..", "complete"),
+    ("!ls -l", "complete"),
+]
+
+
+class IsCompleteTests(unittest.TestCase):
+
+    def test_corpus(self):
+        for code, expected in CORPUS:
+            with self.subTest(code=code):
+                self.assertEqual(is_complete(code), expected)
+
+
+class BlockKeywordsTests(unittest.TestCase):
+
+    def test_block_keywords(self):
+        self.assertEqual(block_keywords("x = 1;"), set())
+        self.assertEqual(
+            block_keywords("for i = 1:3\nif i, x(end) = i; end\nend"),
+            {"for", "if"})
+        self.assertEqual(block_keywords("s.while = 1; % for"), set())
+        self.assertEqual(block_keywords("disp('while')"), set())
+        self.assertEqual(block_keywords("function f\nend"), {"function"})